@@ -0,0 +1,243 @@
+"""A benchmark of the engine on the positions in benchmark_positions.json.
+
+Each configuration below is an engine setting that is run on the positions of some
+phases of the game. The engine is seeded before each position, and the transposition
+table is cleared, so that a configuration searches the same nodes and makes the same
+moves each time it is run. The time of a move is the shortest time in repeat runs.
+
+    python benchmark.py --output baseline.json
+
+writes a report with nodes, time, nodes per second, percentiles of the time to
+move and statistics of the search for each configuration as JSON, and
+
+    python benchmark.py --compare baseline.json
+
+runs the benchmark again and compares it with the report in baseline.json. The
+exit status is 1 if there are regressions, which are more nodes than in the baseline
+by more than the threshold, or more time or fewer nodes per second by more than the
+time threshold. The time is only compared for configurations that take at least
+min_seconds in the baseline, since shorter times vary too much. Changed moves are
+also listed, since they can be caused by bugs. Reports are only compared if they are
+made with the same version of the positions and the same seed.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+from engine import EngineInterface, SearchStatistics
+
+# The version of the report format.
+VERSION = 1
+
+DEFAULT_POSITIONS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                      "benchmark_positions.json")
+
+# The configurations, with the difficulty level, other arguments to EngineInterface,
+# the node budget of engine_move and the phases of the positions they are run on.
+CONFIGURATIONS = [
+    {"name": "level-1", "level": 1, "engine": {}, "max_nodes": None,
+     "phases": ["opening", "middlegame", "endgame"]},
+    {"name": "level-2", "level": 2, "engine": {}, "max_nodes": None,
+     "phases": ["opening", "middlegame", "endgame"]},
+    {"name": "level-3", "level": 3, "engine": {}, "max_nodes": None,
+     "phases": ["opening", "middlegame", "endgame"]},
+    {"name": "level-3-no-evaluation", "level": 3, "engine": {"static_evaluation": False},
+     "max_nodes": None, "phases": ["opening", "middlegame", "endgame"]},
+    {"name": "level-3-20000-nodes", "level": 3, "engine": {}, "max_nodes": 20000,
+     "phases": ["opening", "middlegame", "endgame"]},
+    {"name": "level-4", "level": 4, "engine": {"level_4_time_limit_ms": None},
+     "max_nodes": None,
+     "phases": ["middlegame", "endgame"]},
+]
+
+def load_positions(path=DEFAULT_POSITIONS_PATH):
+    """Return the version and the list of positions in a positions file."""
+    with open(path) as f:
+        data = json.load(f)
+    return (data["version"], data["positions"])
+
+def percentile(values, p):
+    """Return the p-th percentile of values with the nearest rank method."""
+    values = sorted(values)
+    rank = max(-(-len(values) * p // 100), 1)
+    return values[rank - 1]
+
+def run_configuration(configuration, positions, seed, repeat):
+    """Return the report of a configuration."""
+    engine = EngineInterface(configuration["level"], statistics=True, seed=seed,
+                             **configuration["engine"])
+    total = SearchStatistics()
+    position_reports = []
+    for position in positions:
+        if position["phase"] not in configuration["phases"]:
+            continue
+        fastest = None
+        for run in range(repeat):
+            engine.new_game()
+            engine.seed(seed)
+            for column in position["moves"]:
+                engine.make_move(int(column))
+            move = engine.engine_move(max_nodes=configuration["max_nodes"])
+            statistics = engine.move_statistics
+            if fastest == None or statistics.seconds < fastest.seconds:
+                fastest = statistics
+        total.add(fastest)
+        position_reports.append({"name": position["name"], "move": move,
+                                 "nodes": fastest.nodes, "seconds": fastest.seconds})
+    engine.close()
+
+    times = [1000 * position["seconds"] for position in position_reports]
+    statistics = total.as_dict()
+    return {"level": configuration["level"],
+            "moves": len(position_reports),
+            "nodes": total.nodes,
+            "seconds": total.seconds,
+            "nodes_per_second": statistics["nodes_per_second"],
+            "time_ms": {"p50": percentile(times, 50), "p90": percentile(times, 90),
+                        "p99": percentile(times, 99), "max": max(times)},
+            "statistics": statistics,
+            "positions": position_reports}
+
+def run_benchmark(configuration_names=None, positions_path=DEFAULT_POSITIONS_PATH,
+                  seed=1, repeat=3, verbose=False):
+    """Run the configurations with names in configuration_names, or all if it is
+    None, and return the report as a dictionary.
+    """
+    positions_version, positions = load_positions(positions_path)
+    report = {"version": VERSION,
+              "positions_version": positions_version,
+              "seed": seed,
+              "repeat": repeat,
+              "python": platform.python_version(),
+              "platform": platform.platform(),
+              "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+              "configurations": {}}
+    for configuration in CONFIGURATIONS:
+        if configuration_names != None and configuration["name"] not in configuration_names:
+            continue
+        if verbose:
+            print("Running " + configuration["name"], file=sys.stderr)
+        report["configurations"][configuration["name"]] = run_configuration(
+            configuration, positions, seed, repeat)
+    return report
+
+def summary(report):
+    """Return a table with the main numbers of a report."""
+    lines = ["%-24s %6s %10s %9s %11s %9s %9s %8s"
+             % ("configuration", "moves", "nodes", "time s", "nodes/s", "p50 ms",
+                "p90 ms", "tt hits")]
+    for (name, result) in report["configurations"].items():
+        lines.append("%-24s %6d %10d %9.3f %11.0f %9.2f %9.2f %7.1f%%"
+                     % (name, result["moves"], result["nodes"], result["seconds"],
+                        result["nodes_per_second"], result["time_ms"]["p50"],
+                        result["time_ms"]["p90"],
+                        100 * result["statistics"]["tt_hit_rate"]))
+    return "\n".join(lines)
+
+def compare(baseline, report, threshold=0.05, time_threshold=0.10, min_seconds=0.5):
+    """Return a pair (regressions, notes) with lists of texts that describe the
+    regressions of report compared to baseline and other differences.
+    Raise ValueError if the reports can't be compared.
+    """
+    for key in ["version", "positions_version", "seed"]:
+        if baseline[key] != report[key]:
+            raise ValueError("The reports have different %s: %s and %s"
+                             % (key, baseline[key], report[key]))
+    regressions = []
+    notes = []
+
+    def check(name, quantity, old, new, limit, higher_is_better=False):
+        if old == 0:
+            return
+        change = new / old - 1
+        if higher_is_better:
+            change = -change
+        if change > limit:
+            regressions.append("%s: %s %s -> %s (%+.1f%%)"
+                               % (name, quantity, round(old, 3), round(new, 3),
+                                  100 * (new / old - 1)))
+
+    for (name, old) in baseline["configurations"].items():
+        new = report["configurations"].get(name)
+        if new == None:
+            notes.append("%s: not in the report" % name)
+            continue
+        check(name, "nodes", old["nodes"], new["nodes"], threshold)
+        if old["seconds"] >= min_seconds:
+            check(name, "seconds", old["seconds"], new["seconds"], time_threshold)
+            check(name, "nodes/s", old["nodes_per_second"], new["nodes_per_second"],
+                  time_threshold, higher_is_better=True)
+        if old["nodes"] > 0 and new["nodes"] / old["nodes"] - 1 < -threshold:
+            notes.append("%s: nodes %d -> %d (%+.1f%%)"
+                         % (name, old["nodes"], new["nodes"],
+                            100 * (new["nodes"] / old["nodes"] - 1)))
+        new_moves = {position["name"]: position["move"] for position in new["positions"]}
+        for position in old["positions"]:
+            move = new_moves.get(position["name"])
+            if move != position["move"]:
+                notes.append("%s: %s move %s -> %s"
+                             % (name, position["name"], position["move"], move))
+    return (regressions, notes)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the engine.")
+    parser.add_argument("--output", help="write the report as JSON to this file")
+    parser.add_argument("--compare", metavar="BASELINE",
+                        help="compare the report with a report in this file")
+    parser.add_argument("--input", metavar="REPORT",
+                        help="read the report from this file instead of running the "
+                        "benchmark")
+    parser.add_argument("--configurations", nargs="+", metavar="NAME",
+                        choices=[configuration["name"] for configuration in CONFIGURATIONS],
+                        help="the configurations to run, by default all")
+    parser.add_argument("--positions", default=DEFAULT_POSITIONS_PATH,
+                        help="the file with the positions")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="the number of runs of each move")
+    parser.add_argument("--threshold", type=float, default=0.05,
+                        help="the largest relative increase of nodes that is not a "
+                        "regression")
+    parser.add_argument("--time-threshold", type=float, default=0.10,
+                        help="the largest relative increase of time that is not a "
+                        "regression")
+    parser.add_argument("--min-seconds", type=float, default=0.5,
+                        help="the shortest time of a configuration in the baseline "
+                        "for which the time is compared")
+    arguments = parser.parse_args()
+
+    if arguments.input != None:
+        with open(arguments.input) as f:
+            report = json.load(f)
+    else:
+        report = run_benchmark(arguments.configurations, arguments.positions,
+                               arguments.seed, arguments.repeat, verbose=True)
+    print(summary(report))
+    if arguments.output != None:
+        with open(arguments.output, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+
+    if arguments.compare != None:
+        with open(arguments.compare) as f:
+            baseline = json.load(f)
+        try:
+            (regressions, notes) = compare(baseline, report, arguments.threshold,
+                                           arguments.time_threshold,
+                                           arguments.min_seconds)
+        except ValueError as error:
+            print(error)
+            sys.exit(2)
+        print()
+        for note in notes:
+            print(note)
+        if regressions:
+            print("Regressions:")
+            for regression in regressions:
+                print(regression)
+            sys.exit(1)
+        print("No regressions")
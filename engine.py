@@ -1,17 +1,219 @@
+import array
+import multiprocessing
+import os
 import random
+import struct
+import sys
+import threading
+import time
+
+from profiling import DEFAULT_DIRECTORY, MoveProfiler, profile_directory_from_environment
+
+# If True, the transposition table also stores the full position key for every entry
+# and checks it at each lookup. This is slower and only intended for debugging.
+VERIFY_TRANSPOSITION_TABLE = False
 
 
 class EngineInterface():
     """This class is intended to be the interface for this module."""
-    def __init__(self, difficulty_level):
-        """difficulty_level can be 1, 2 or 3."""
+    def __init__(self, difficulty_level, transposition_table_entries=1 << 20,
+                 transposition_table_bytes=None, transposition_table=None,
+                 move_ordering=None, static_evaluation=True, evaluator=None,
+                 opening_book=None, position_database=None,
+                 keep_transposition_table=False, transposition_table_file=None,
+                 workers=1, aspiration_window=None, statistics=False,
+                 profile=False, profile_directory=None, seed=None,
+                 level_4_time_limit_ms=5000):
+        """difficulty_level can be 1, 2, 3 or 4, where 4 is perfect play. The size of
+        the transposition table is transposition_table_entries, or the number of
+        entries that fit in transposition_table_bytes if it is given.
+
+        Positions early in the game can't be solved in a practical time, so the
+        moves of level 4 are searched for at most level_4_time_limit_ms milliseconds
+        if engine_move is not given a budget. The move is then perfect only if the
+        search reached the end of the game in that time. If level_4_time_limit_ms is
+        None, the positions are always solved.
+
+        A table from another engine can be given as transposition_table to share it
+        between the engines, for example engine.search.transposition_table.
+        A shared table is not cleared when a new game is started.
+
+        move_ordering is the policy for the order moves are searched in, for example
+        StaticMoveOrdering(). The default is DynamicMoveOrdering().
+
+        If static_evaluation is True, level 3 gives the positions at the end of its
+        searches a static evaluation with the function evaluator, which is
+        threat_evaluation if it is not given. The searches are then made 4 moves less
+        deep, which tests show give both a stronger and a faster engine. Otherwise
+        such positions are given the value 0.
+
+        opening_book is an OpeningBook from opening_book.py, or None. On level 3 and 4,
+        the moves in the book are used instead of a search.
+
+        position_database is a PositionDatabase from position_database.py, or None.
+        The searches use the scores in the database, and level 3 searches at least
+        to the positions in the database.
+
+        If keep_transposition_table is True, the transposition table is not cleared
+        when a new game is started. If transposition_table_file is given, the table
+        is also kept, it is loaded from the file before the first search if the file
+        exists and close() saves the deep entries of the table to the file.
+
+        If workers is larger than 1, the moves of level 3 and 4 are searched in
+        parallel by that many worker processes, which each have a transposition table
+        with transposition_table_entries entries. This is not done for small searches
+        or with a time or node budget.
+
+        If aspiration_window is given, level 3 first searches with a window of that
+        size around the score of the previous search, for example 1/2. It must be a
+        positive multiple of 1/64, since the transposition table stores values as
+        multiples of 1/64, and otherwise ValueError is raised.
+
+        If statistics is True, counters of the searches are collected, which
+        search_statistics returns after each engine_move.
+
+        If profile is True, or the environment variable FOUR_IN_A_ROW_PROFILE is set,
+        each engine_move is run in cProfile and its profile is written to
+        profile_directory, see profiling.py. profile_report returns the functions
+        where the most time was spent in all moves.
+
+        The random choices of the engine are made with a random.Random of its own,
+        which is seeded with seed. With the same seed, the engine makes the same moves
+        in the same positions.
+        """
+        if aspiration_window != None and (aspiration_window <= 0
+                                          or 64 * aspiration_window % 1 != 0):
+            raise ValueError("The aspiration window must be a positive multiple of "
+                             "1/64: %r" % aspiration_window)
         self.game_state = GameState()
         self.difficulty_level = difficulty_level
-        reset_transposition_table()
+        self.shared_transposition_table = transposition_table != None
+        if transposition_table == None:
+            transposition_table = TranspositionTable(transposition_table_entries,
+                                                     transposition_table_bytes)
+        self.static_evaluation = static_evaluation
+        if evaluator == None:
+            evaluator = threat_evaluation
+        self.evaluator = evaluator
+        self.search = SearchState(transposition_table, move_ordering,
+                                  position_database=position_database)
+        self.search.workers = workers
+        self.search.aspiration_window = aspiration_window
+        self.search.random = random.Random(seed)
+        self.ponder_thread = None
+        self.ponder_search = None
+        self.ponder_moves = {}
+        self.search.worker_transposition_table_entries = transposition_table_entries
+        self.keep_transposition_table = (keep_transposition_table
+                                         or transposition_table_file != None)
+        self.transposition_table_file = transposition_table_file
+        self.transposition_table_loaded = transposition_table_file == None
+        self.opening_book = opening_book
+        self.level_4_time_limit_ms = level_4_time_limit_ms
+        self.collect_statistics = statistics
+        self.reset_statistics()
+        environment_directory = profile_directory_from_environment()
+        if profile_directory == None:
+            profile_directory = environment_directory
+        if profile_directory == None:
+            profile_directory = DEFAULT_DIRECTORY
+        if profile or environment_directory != None:
+            self.profiler = MoveProfiler(profile_directory)
+        else:
+            self.profiler = None
 
     def new_game(self):
+        self.stop_pondering()
+        self.ponder_moves = {}
         self.game_state = GameState()
-        reset_transposition_table()
+        if not (self.shared_transposition_table or self.keep_transposition_table):
+            self.search.transposition_table.clear()
+        self.search.move_ordering.clear()
+        self.search.previous_score = None
+        self.search.stopped = False
+
+    def seed(self, seed):
+        """Seed the random number generator of the engine."""
+        self.search.random.seed(seed)
+
+    def load_transposition_table(self):
+        """Load the transposition table from transposition_table_file the first time
+        it is called. A file that is missing or made by another version of the
+        engine is ignored.
+        """
+        if self.transposition_table_loaded:
+            return
+        self.transposition_table_loaded = True
+        try:
+            self.search.transposition_table.load(self.transposition_table_file)
+        except (OSError, ValueError):
+            pass
+
+    def close(self):
+        """Stop the worker processes and save the transposition table to
+        transposition_table_file, if it is given. Return False if the file couldn't
+        be written. With profiling, the sum of the profiles is also saved.
+        """
+        self.stop_pondering()
+        self.search.close()
+        if self.profiler != None:
+            self.profiler.save()
+        if self.transposition_table_file == None:
+            return True
+        self.load_transposition_table()
+        try:
+            self.search.transposition_table.save(self.transposition_table_file)
+        except OSError:
+            return False
+        return True
+
+    def transposition_table_statistics(self):
+        """Return a dictionary with the capacity, number of entries, occupancy, number
+        of stores and number of evictions of the transposition table.
+        """
+        return self.search.transposition_table.statistics()
+
+    def reset_statistics(self):
+        """Reset the statistics of the searches, which are otherwise summed over all
+        games.
+        """
+        self.move_statistics = None
+        self.total_statistics = SearchStatistics()
+
+    def search_statistics(self):
+        """Return None if the engine was not made with statistics=True. Otherwise
+        return a dictionary where "move" has the statistics of the last engine_move,
+        or None before the first move, and "total" has the statistics of all moves
+        since the engine was made or reset_statistics was called. The statistics
+        are dictionaries as returned by SearchStatistics.as_dict.
+        """
+        if not self.collect_statistics:
+            return None
+        if self.move_statistics == None:
+            move_statistics = None
+        else:
+            move_statistics = self.move_statistics.as_dict()
+        return {"move": move_statistics, "total": self.total_statistics.as_dict()}
+
+    def statistics_report(self):
+        """Return the statistics of the last move and of all moves as text, or
+        an empty string if no statistics are collected.
+        """
+        if not self.collect_statistics:
+            return ""
+        lines = []
+        if self.move_statistics != None:
+            lines.append("Move:  " + str(self.move_statistics))
+        lines.append("Total: " + str(self.total_statistics))
+        return "\n".join(lines)
+
+    def profile_report(self, limit=20):
+        """Return a text with the limit functions with the most time in the profiled
+        engine moves, or an empty string if the moves are not profiled.
+        """
+        if self.profiler == None:
+            return ""
+        return self.profiler.report(limit)
 
     def board_value(self, column, row):
         """Return "0" for an empty position, "1" for a first player disk and
@@ -38,7 +240,7 @@ class EngineInterface():
         Positions are given as a set of (column, row)-pairs.
         """
         def disk_type(column, row):
-            return self.game_state.board[10 + column + row * 9]
+            return self.game_state.get_value(column, row)
 
         def disks_are_of_same_type(col_row_pair_set):
             type_ = None
@@ -86,36 +288,222 @@ class EngineInterface():
 
         return four_in_a_rows
 
-    def engine_move(self):
+    def engine_move(self, time_limit_ms=None, max_nodes=None):
         """Return an integer from 0 to 6 that represents a move made
-        by the engine."""
-        if self.difficulty_level == 1:
-            return computer_move_level_1(self.game_state)
-        if self.difficulty_level == 2:
-            return computer_move_level_2(self.game_state)
-        if self.difficulty_level == 3:
-            return computer_move_level_3(self.game_state)
+        by the engine.
+
+        If time_limit_ms or max_nodes is given, the search is made with iterative
+        deepening and the best move from the deepest completed search is returned
+        when the time or the number of searched nodes runs out. On level 3, the search
+        is then not limited by a depth. On level 4, the time limit is
+        level_4_time_limit_ms if neither is given.
+        """
+        self.stop_pondering()
+        self.search.nodes = 0
+        self.load_transposition_table()
+        if self.collect_statistics:
+            statistics = SearchStatistics()
+            statistics.moves = 1
+            self.search.statistics = statistics
+            stores = self.search.transposition_table.stores
+            start_time = time.perf_counter()
+        try:
+            if self.profiler != None:
+                return self.profiler.run(self.find_engine_move, time_limit_ms, max_nodes)
+            return self.find_engine_move(time_limit_ms, max_nodes)
+        finally:
+            if self.collect_statistics:
+                statistics.seconds = time.perf_counter() - start_time
+                statistics.nodes = self.search.nodes
+                statistics.tt_stores = self.search.transposition_table.stores - stores
+                self.search.statistics = None
+                self.move_statistics = statistics
+                self.total_statistics.add(statistics)
+
+    def find_engine_move(self, time_limit_ms, max_nodes):
+        """Return the move of engine_move."""
+        statistics = self.search.statistics
+        if self.opening_book != None and self.difficulty_level >= 3:
+            book_entry = self.opening_book.get(self.game_state)
+            if book_entry != None:
+                if statistics != None:
+                    statistics.book_moves += 1
+                return book_entry[0]
+
+        if self.difficulty_level == 4 and time_limit_ms == None and max_nodes == None:
+            time_limit_ms = self.level_4_time_limit_ms
+
+        # A move found by pondering is used if it was searched at the same level with
+        # the same time limit. The searches with a time limit can still differ, since
+        # the number of nodes that are searched in the time varies.
+        if max_nodes == None:
+            ponder_move = self.ponder_moves.get((self.difficulty_level, time_limit_ms,
+                                                 self.game_state.key()))
+            if ponder_move != None:
+                if statistics != None:
+                    statistics.ponder_moves += 1
+                # The random number generator is left as after the same search.
+                (move, random_state) = ponder_move
+                self.search.random.setstate(random_state)
+                return move
+
+        self.search.set_budget(time_limit_ms, max_nodes)
+        self.search.evaluator = self.level_evaluator()
+        self.search.transposition_table.use_evaluation(
+            evaluation_name(self.search.evaluator))
+        number_of_moves = self.game_state.number_of_moves
+        try:
+            return computer_move_at_level(self.search, self.game_state,
+                                          self.difficulty_level)
+        except SearchAborted:
+            self.undo_search_moves(number_of_moves)
+            raise
+        finally:
+            self.search.set_budget()
+
+    def undo_search_moves(self, number_of_moves):
+        """Undo the moves made by a search that was aborted, so that the game has
+        number_of_moves moves again.
+        """
+        while self.game_state.number_of_moves > number_of_moves:
+            self.game_state.undo_last_move()
+
+    def stop_search(self):
+        """Make an engine_move or solve that is running in another thread raise
+        SearchAborted as soon as possible. The searches are stopped in the same way
+        until new_game is called.
+        """
+        self.search.stop()
+
+    def level_evaluator(self):
+        """Return the static evaluation function of the difficulty level, or None."""
+        if self.static_evaluation and self.difficulty_level >= 3:
+            return self.evaluator
+        return None
+
+    def start_pondering(self):
+        """Search the possible moves of the opponent in a background thread, until
+        engine_move or stop_pondering is called. The searches fill the transposition
+        table, and if the opponent makes one of the searched moves, engine_move
+        returns the move found by the search directly. It is intended to be called
+        when the opponent is in turn, for example after a move by the engine.
+        Pondering is only done on level 3 and 4. On level 4, each reply is searched
+        with the time limit level_4_time_limit_ms, like the moves of engine_move.
+
+        Each reply is searched with a random number generator in the same state as
+        the one of the engine, so that a seeded engine makes the same random choices
+        with and without pondering. The moves can still differ, since the entries
+        that pondering stores in the transposition table can change the results of
+        later searches that are not made to the end of the game.
+        """
+        self.stop_pondering()
+        self.ponder_moves = {}
+        if (self.difficulty_level < 3 or self.game_state.number_of_moves >= 41
+            or self.game_state.four_in_a_row()):
+            return
+        search = SearchState(self.search.transposition_table, self.search.move_ordering,
+                             self.level_evaluator(), self.search.position_database)
+        search.transposition_table.use_evaluation(evaluation_name(search.evaluator))
+        search.endgame_empty_cells = self.search.endgame_empty_cells
+        search.aspiration_window = self.search.aspiration_window
+        self.ponder_search = search
+        random_state = self.search.random.getstate()
+        if self.difficulty_level == 4:
+            time_limit_ms = self.level_4_time_limit_ms
+        else:
+            time_limit_ms = None
+        moves = self.game_state.move_history[:self.game_state.number_of_moves]
+        self.ponder_thread = threading.Thread(target=self.ponder,
+                                              args=(search, moves, self.difficulty_level,
+                                                    time_limit_ms, random_state),
+                                              daemon=True)
+        self.ponder_thread.start()
+
+    def stop_pondering(self):
+        """Stop the search started by start_pondering and wait for it to stop."""
+        if self.ponder_thread != None:
+            self.ponder_search.stop()
+            self.ponder_thread.join()
+            self.ponder_thread = None
+
+    def ponder(self, search, moves, difficulty_level, time_limit_ms, random_state):
+        """Search the replies to the position given by moves, in the order they are
+        likely to be played. Each search has the time limit time_limit_ms, or no limit
+        if it is None, and starts with the random number generator in random_state.
+        Called in the thread started by start_pondering.
+        """
+        game_state = GameState()
+        for move in moves:
+            game_state.make_move(move)
+
+        # The best reply from the last search of the engine is searched first.
+        replies = [3,2,4,1,5,0,6]
+        if VERIFY_TRANSPOSITION_TABLE:
+            position_key = game_state.canonical_key()
+        else:
+            position_key = None
+        entry = search.transposition_table.get(game_state.canonical_hash(), position_key)
+        if entry and entry_move(entry) != 7:
+            reply = entry_move(entry)
+            if game_state.mirror_hash < game_state.hash:
+                reply = 6 - reply
+            replies.remove(reply)
+            replies.insert(0, reply)
+
+        for reply in replies:
+            if game_state.column_height[reply] == 6:
+                continue
+            game_state.make_move(reply)
+            if not game_state.four_in_a_row():
+                search.random.setstate(random_state)
+                search.set_budget(time_limit_ms)
+                try:
+                    move = computer_move_at_level(search, game_state, difficulty_level)
+                except SearchAborted:
+                    return
+                self.ponder_moves[(difficulty_level, time_limit_ms, game_state.key())] = (
+                    move, search.random.getstate())
+            game_state.undo_last_move()
+
+    def solve(self):
+        """Return the score of the current position for the player in turn, with
+        perfect play from both players. A win at move 42 give the score 1, a win at
+        move 41 give the score 2 etc, a draw give 0 and losses give negative scores.
+        """
+        self.stop_pondering()
+        self.search.nodes = 0
+        self.load_transposition_table()
+        if self.opening_book != None:
+            book_entry = self.opening_book.get(self.game_state)
+            if book_entry != None:
+                return book_entry[1]
+        number_of_moves = self.game_state.number_of_moves
+        try:
+            return solve(self.search, self.game_state)
+        except SearchAborted:
+            self.undo_search_moves(number_of_moves)
+            raise
 
 
 class GameState:
     """Instances of this object stores game states. A board configuration is stored as
-    a list of lengths 72. Empty positions are stored as "0". The players are called "1" and "2",
-    where "1" always make the first move.
+    two integers that are used as bitboards. The bits of position are set for the disks
+    of the player in turn and the bits of mask are set for all disks on the board.
+    The players are called "1" and "2", where "1" always make the first move.
 
-    Some of the entries in the list is always 0. They represent the positions outside of the
-    board, as in the following diagram.
+    Each column is represented by 7 bits, one for each row and one extra bit on top
+    that is always 0. The bits are numbered as in the following diagram.
 
-    000000000
-    0xxxxxxx0
-    0xxxxxxx0
-    0xxxxxxx0
-    0xxxxxxx0
-    0xxxxxxx0
-    0xxxxxxx0
-    000000000
+    .  .  .  .  .  .  .
+    5 12 19 26 33 40 47
+    4 11 18 25 32 39 46
+    3 10 17 24 31 38 45
+    2  9 16 23 30 37 44
+    1  8 15 22 29 36 43
+    0  7 14 21 28 35 42
 
-    The positions with x are the positions on the board. The position in the lower left
-    corner have index 10, the next index 11 etc.
+    The empty row on top makes it possible to find four in a rows with a few shifts,
+    since disks never are shifted from the top of one column to the bottom of the next.
 
     Many times in this program, rows and columns are refered to. Rows are counted from
     below and numbered 0, 1, ..., 5. Columns are counted from the left and are numbered
@@ -125,7 +513,14 @@ class GameState:
         self.number_of_moves = 0
         self.column_height = [0,0,0,0,0,0,0]
         self.move_history = [None]*42
-        self.board = ["0"]*72
+        self.position = 0
+        self.mask = 0
+        # A Zobrist hash of the position. It is the XOR of one random 64 bit number
+        # for each disk, chosen by the position and the player of the disk, and it is
+        # updated when moves are made and undone.
+        self.hash = 0
+        # The Zobrist hash of the position mirrored in the middle column.
+        self.mirror_hash = 0
 
     def print_board(self):
         """Print the game state."""
@@ -137,106 +532,133 @@ class GameState:
         print()
 
     def get_value(self, column, row):
-        return self.board[10 + column + row * 9]
+        cell = 1 << (column * 7 + row)
+        if not self.mask & cell:
+            return "0"
+        if self.position & cell:
+            return ("1", "2")[self.number_of_moves % 2]
+        return ("2", "1")[self.number_of_moves % 2]
 
     def make_move(self, column):
-        position = 10 + column + self.column_height[column] * 9
-        self.board[position] = ("1", "2")[self.number_of_moves % 2]
-        self.move_history[self.number_of_moves] = position
+        # The opponent is in turn after the move, so position is changed to the
+        # disks of the opponent.
+        cell = column * 7 + self.column_height[column]
+        self.position ^= self.mask
+        self.mask |= 1 << cell
+        self.hash ^= zobrist_keys[self.number_of_moves % 2][cell]
+        self.mirror_hash ^= mirror_zobrist_keys[self.number_of_moves % 2][cell]
+        self.move_history[self.number_of_moves] = column
         self.column_height[column] += 1
         self.number_of_moves += 1
 
     def undo_last_move(self):
         self.number_of_moves -= 1
-        position = self.move_history[self.number_of_moves]
-        self.column_height[position % 9 - 1] -= 1
-        self.board[position] = "0"
+        column = self.move_history[self.number_of_moves]
+        self.column_height[column] -= 1
+        cell = column * 7 + self.column_height[column]
+        self.mask ^= 1 << cell
+        self.position ^= self.mask
+        self.hash ^= zobrist_keys[self.number_of_moves % 2][cell]
+        self.mirror_hash ^= mirror_zobrist_keys[self.number_of_moves % 2][cell]
 
     def make_null_move(self):
+       self.position ^= self.mask
        self.number_of_moves += 1
 
     def undo_null_move(self):
+       self.position ^= self.mask
        self.number_of_moves -= 1
 
     def key(self):
         """Return a unique key for the position that can be used in a dictionary."""
-        return "".join(self.board)
+        return self.position + self.mask
+
+    def mirror_key(self):
+        """Return the key of the position mirrored in the middle column."""
+        key = self.position + self.mask
+        mirrored_key = 0
+        for column in range(7):
+            mirrored_key |= ((key >> (column * 7)) & 127) << ((6 - column) * 7)
+        return mirrored_key
+
+    def canonical_key(self):
+        """Return a key that is the same for the position and its mirrored position."""
+        return min(self.key(), self.mirror_key())
+
+    def canonical_hash(self):
+        """Return a hash that is the same for the position and its mirrored position."""
+        return min(self.hash, self.mirror_hash)
 
     def can_win_this_move(self):
         """Return true iff a the player in turn can make a move a move that gives
            a four in a row."""
-        for move in range(7):
-            if self.column_height[move] < 6:
-                self.make_move(move)
-                if self.four_in_a_row():
-                    self.undo_last_move()
-                    return True
-                self.undo_last_move()
-        return False
+        possible_moves = (self.mask + BOTTOM_ROW) & BOARD
+        return winning_cells(self.position, self.mask) & possible_moves != 0
 
     def four_in_a_row(self):
         """True iff there is a four in a row that goes through the last made move."""
-        position = self.move_history[self.number_of_moves - 1]
-        player = self.board[position]
-
-        # Columns
-        if position // 9 >= 4:
-            if self.board[position - 9] == player:
-                if self.board[position - 18] == player:
-                    if self.board[position - 27] == player:
-                        return True
-
-        # Rows
-        in_row = 1
-        if self.board[position - 1] == player:
-            in_row += 1
-            if self.board[position - 2] == player:
-                in_row += 1
-                if self.board[position - 3] == player:
-                    in_row += 1
-        if self.board[position + 1] == player:
-            in_row += 1
-            if self.board[position + 2] == player:
-                in_row += 1
-                if self.board[position + 3] == player:
-                    in_row += 1
-        if in_row >= 4:
-            return True
-
-        # Diagonals
-        in_row = 1
-        if self.board[position - 10] == player:
-            in_row += 1
-            if self.board[position - 20] == player:
-                in_row += 1
-                if self.board[position - 30] == player:
-                    in_row += 1
-        if self.board[position + 10] == player:
-            in_row += 1
-            if self.board[position + 20] == player:
-                in_row += 1
-                if self.board[position + 30] == player:
-                    in_row += 1
-        if in_row >= 4:
-            return True
-
-        in_row = 1
-        if self.board[position - 8] == player:
-            in_row += 1
-            if self.board[position - 16] == player:
-                in_row += 1
-                if self.board[position - 24] == player:
-                    in_row += 1
-        if self.board[position + 8] == player:
-            in_row += 1
-            if self.board[position + 16] == player:
-                in_row += 1
-                if self.board[position + 24] == player:
-                    in_row += 1
-        if in_row >= 4:
-            return True
-
-        return False
+        # The disks of the player that made the last move.
+        return alignment(self.position ^ self.mask)
+
+# Random numbers for Zobrist hashing, indexed by player (0 for "1" and 1 for "2")
+# and bit number. A fixed seed is used so that hashes are the same in all processes.
+_zobrist_random = random.Random(4)
+zobrist_keys = [[_zobrist_random.getrandbits(64) for bit in range(49)] for player in range(2)]
+# The same numbers, but for the mirrored bit numbers.
+mirror_zobrist_keys = [[keys[(6 - bit // 7) * 7 + bit % 7] for bit in range(49)]
+                       for keys in zobrist_keys]
+
+# Bitboards with the bottom row, all positions on the board and each column.
+BOTTOM_ROW = sum(1 << (column * 7) for column in range(7))
+BOARD = BOTTOM_ROW * 63
+COLUMNS = [63 << (column * 7) for column in range(7)]
+
+def alignment(disks):
+    """Return true iff the bitboard disks have a four in a row."""
+    # Rows.
+    pairs = disks & (disks >> 7)
+    if pairs & (pairs >> 14):
+        return True
+
+    # Diagonals.
+    pairs = disks & (disks >> 8)
+    if pairs & (pairs >> 16):
+        return True
+    pairs = disks & (disks >> 6)
+    if pairs & (pairs >> 12):
+        return True
+
+    # Columns.
+    pairs = disks & (disks >> 1)
+    if pairs & (pairs >> 2):
+        return True
+
+    return False
+
+def winning_cells(disks, mask):
+    """Return a bitboard with the empty positions that would give the player with the
+    bitboard disks a four in a row. mask is the bitboard with all disks on the board.
+    """
+    # Columns.
+    cells = (disks << 1) & (disks << 2) & (disks << 3)
+
+    # Rows.
+    pairs = (disks << 7) & (disks << 14)
+    cells |= pairs & ((disks << 21) | (disks >> 7))
+    pairs = (disks >> 7) & (disks >> 14)
+    cells |= pairs & ((disks << 7) | (disks >> 21))
+
+    # Diagonals.
+    pairs = (disks << 6) & (disks << 12)
+    cells |= pairs & ((disks << 18) | (disks >> 6))
+    pairs = (disks >> 6) & (disks >> 12)
+    cells |= pairs & ((disks << 6) | (disks >> 18))
+    pairs = (disks << 8) & (disks << 16)
+    cells |= pairs & ((disks << 24) | (disks >> 8))
+    pairs = (disks >> 8) & (disks >> 16)
+    cells |= pairs & ((disks << 8) | (disks >> 24))
+
+    return cells & (BOARD ^ mask)
 
 def heuristic_function_constant(game_state, move):
     return 0
@@ -278,7 +700,61 @@ def heuristic_function_4(game_state, move):
               [0, 0, 0, 0, 0, 0, 0]]
     return values[row][move]
 
-def heuristic_move(game_state, move_list, heuristic_function):
+# Bitboards with the rows 0, 2, 4 and the rows 1, 3, 5, and the central positions
+# that are given the value 1 by heuristic_function_4.
+EVEN_ROWS = BOTTOM_ROW * 0b010101
+ODD_ROWS = BOTTOM_ROW * 0b101010
+CENTER = sum(1 << (column * 7 + row)
+             for (row, columns) in [(1, range(2, 5)), (2, range(1, 6)),
+                                    (3, range(1, 6)), (4, range(2, 5))]
+             for column in columns)
+
+def threat_evaluation(game_state):
+    """Return a static evaluation of game_state for the player in turn, as an integer
+    from -63 to 63. The evaluation is based on
+
+    - the number of empty positions where each player can make four in a row,
+    - the number of such positions on rows that are good for the player. With
+      perfect play the first player gets the odd rows 1, 3, 5 when counted from 1,
+      and the second player gets the even rows, if the board is filled,
+    - the number of disks on central positions, as in heuristic_function_4.
+
+    The values of wins and losses are at least 1 and are used by negamax, so this
+    value is divided by 64 before it is used.
+    """
+    position = game_state.position
+    opponent_position = position ^ game_state.mask
+    threats = winning_cells(position, game_state.mask)
+    opponent_threats = winning_cells(opponent_position, game_state.mask)
+    if game_state.number_of_moves % 2 == 0:
+        good_rows = EVEN_ROWS
+    else:
+        good_rows = ODD_ROWS
+    value = (4 * (bin(threats).count("1") - bin(opponent_threats).count("1"))
+             + 4 * (bin(threats & good_rows).count("1")
+                    - bin(opponent_threats & (BOARD ^ good_rows)).count("1"))
+             + bin(position & CENTER).count("1") - bin(opponent_position & CENTER).count("1"))
+    return max(-63, min(63, value))
+
+def claimeven_bound(game_state):
+    """Return an upper bound for the value of game_state for the player in turn given by
+       the claimeven rule, or None if the rule can't be used. The rule can be used if
+       every column has an even number of empty cells. The opponent can then always play
+       on top of the move of the player in turn. The player in turn will then get all
+       empty cells in the first, third and fifth row and the opponent the rest. If the
+       player in turn can't make four in a row that way, the value is at most 0. If the
+       opponent also can make four in a row, the value is at most -1."""
+    mask = game_state.mask
+    if (mask + BOTTOM_ROW) & ODD_ROWS:
+        return None
+    empty_cells = BOARD & ~mask
+    if alignment(game_state.position | (empty_cells & EVEN_ROWS)):
+        return None
+    if alignment((game_state.position ^ mask) | (empty_cells & ODD_ROWS)):
+        return -1
+    return 0
+
+def heuristic_move(search, game_state, move_list, heuristic_function):
     """Return a move from move_list that is given the highest value by
     heuristic_function. It there are several such moves, then one of
     them are chosen randomly.
@@ -289,42 +765,45 @@ def heuristic_move(game_state, move_list, heuristic_function):
     for i in range(len(move_list)):
         if heuristic_values[i] == max_value:
             best_moves.append(move_list[i])
-    return random.choice(best_moves)
+    return search.random.choice(best_moves)
 
 def blocking_moves(game_state):
     """Return a list of moves that blocks an immediate four in a row for the opponent if
     such move exists.
     """
-    move_list = []
-    available_moves = [move for move in [3,2,4,1,5,0,6] if game_state.column_height[move] < 6]
-    game_state.make_null_move()
-
-    for col in available_moves:
-        game_state.make_move(col)
-        if game_state.four_in_a_row():
-            move_list.append(col)
-        game_state.undo_last_move()
-
-    game_state.undo_null_move()
-    return move_list
-
-def computer_move_level_1(game_state):
-    x = random.random()
+    possible_moves = (game_state.mask + BOTTOM_ROW) & BOARD
+    opponent_winning_cells = winning_cells(game_state.position ^ game_state.mask,
+                                           game_state.mask)
+    return [move for move in [3,2,4,1,5,0,6]
+            if possible_moves & opponent_winning_cells & COLUMNS[move]]
+
+def computer_move_at_level(search, game_state, difficulty_level):
+    if difficulty_level == 1:
+        return computer_move_level_1(search, game_state)
+    if difficulty_level == 2:
+        return computer_move_level_2(search, game_state)
+    if difficulty_level == 3:
+        return computer_move_level_3(search, game_state)
+    if difficulty_level == 4:
+        return computer_move_level_4(search, game_state)
+
+def computer_move_level_1(search, game_state):
+    x = search.random.random()
     if x < 0.3:
         depth = min(game_state.number_of_moves + 2, 42)
     else:
         depth = min(game_state.number_of_moves + 3, 42)
-    return computer_move(game_state, depth, heuristic_function_constant)
+    return computer_move(search, game_state, depth, heuristic_function_constant)
 
-def computer_move_level_2(game_state):
-    x = random.random()
+def computer_move_level_2(search, game_state):
+    x = search.random.random()
     depth = min(game_state.number_of_moves + 4, 42)
     if x < 0.3:
-        return computer_move(game_state, depth, heuristic_function_constant)
+        return computer_move(search, game_state, depth, heuristic_function_constant)
     else:
-        return computer_move(game_state, depth, heuristic_function_4)
+        return computer_move(search, game_state, depth, heuristic_function_4)
 
-def computer_move_level_3(game_state):
+def computer_move_level_3(search, game_state):
     available_moves = [move for move in [3,2,4,1,5,0,6] if game_state.column_height[move] < 6]
 
     # Depth for the minimax algorithm is chosen based
@@ -354,9 +833,22 @@ def computer_move_level_3(game_state):
 
     depth = min(depth + 1, 42)
 
+    # With a static evaluation, a less deep search is needed.
+    if search.evaluator != None:
+        depth = max(depth - 4, game_state.number_of_moves + 2)
+
+    # Searches to the positions in the position database give exact values.
+    if (search.position_database != None
+        and game_state.number_of_moves < search.position_database.moves):
+        depth = max(depth, search.position_database.moves + 1)
+
 #    if game_state.number_of_moves > 25:
 #        depth = 42
 
+    # With a time or node budget, the depth is given by iterative deepening.
+    if search.has_budget():
+        depth = 42
+
     # Some opening moves.
     if game_state.number_of_moves == 0:
         return 3
@@ -365,76 +857,477 @@ def computer_move_level_3(game_state):
     if game_state.number_of_moves == 2:
         return 3
 
-    move = computer_move(game_state, depth, heuristic_function_4)
+    move = computer_move(search, game_state, depth, heuristic_function_4)
     return move
 
-def negamax(game_state, depth, alpha, beta):
+def computer_move_level_4(search, game_state):
+    """Return a move with the best score, computed by solve. With a time or node
+    budget, iterative deepening is used instead, which also give perfect play
+    if the budget allows a search to the end of the game. Without a budget, it
+    can't be used early in the game, since a search from a position with 6 moves
+    took more than 19 million nodes and two minutes.
+    """
+    if search.has_budget():
+        # With a time limit, a solve is first tried in half of the time, since it is
+        # faster than iterative deepening when the search reaches the end of the game.
+        if (search.deadline != None
+            and game_state.number_of_moves >= level_4_solve_min_moves):
+            deadline = search.deadline
+            search.deadline = (time.perf_counter() + deadline) / 2
+            number_of_moves = game_state.number_of_moves
+            try:
+                return move_with_score(search, game_state, solve(search, game_state))
+            except SearchAborted:
+                while game_state.number_of_moves > number_of_moves:
+                    game_state.undo_last_move()
+                if search.stopped:
+                    raise
+            finally:
+                search.deadline = deadline
+        return computer_move_level_3(search, game_state)
+
+    available_moves = [move for move in [3,2,4,1,5,0,6] if game_state.column_height[move] < 6]
+    if len(available_moves) == 1:
+        return available_moves[0]
+
+    # With worker processes, the moves are searched in parallel instead.
+    if (search.workers > 1 and 42 - game_state.number_of_moves >= parallel_min_draft
+        and not game_state.can_win_this_move()):
+        search.new_search()
+        return parallel_root_negamax(search, game_state, available_moves, 42,
+                                     -10000, 10000)
+
+    return move_with_score(search, game_state, solve(search, game_state))
+
+def move_with_score(search, game_state, score):
+    """Return a move in game_state that give the score, where score is the value
+    computed by solve.
+    """
+    available_moves = [move for move in [3,2,4,1,5,0,6] if game_state.column_height[move] < 6]
+
+    # Find a move with the score, by testing if the value of the position after
+    # the move is at most -score.
+    for move in available_moves:
+        game_state.make_move(move)
+        if game_state.four_in_a_row():
+            game_state.undo_last_move()
+            return move
+        if game_state.can_win_this_move():
+            value = 42 - game_state.number_of_moves
+        else:
+            value = negamax(search, game_state, 42, -score, -score + 1)
+        game_state.undo_last_move()
+        if value <= -score:
+            return move
+
+def negamax(search, game_state, depth, alpha, beta):
     """Compute a value of game_state. Return a positive integer for a winning game_state for
        the player in turn, 0 for a draw or unknown outcome and a negative integer for a loss.
        A win at move 42 give the score 1, a win at move 41 give a the score 2 etc,
-       and vice versa for losses.
+       and vice versa for losses. If search has an evaluator, unknown outcomes are instead
+       given a value between -1 and 1 from the static evaluation.
        Depth is counted as the move number at which the search is stopped. For example,
        depth=42 give a maximum depth search. This function can only be used on if the game state
-       have no four in a row."""
+       have no four in a row and the player in turn can't make a four in a row this move."""
     original_alpha = alpha;
+    transposition_table = search.transposition_table
+
+    search.nodes += 1
+    if search.nodes >= search.next_budget_check:
+        search.check_budget()
+
+    # Positions in the position database have an exact score.
+    position_database = search.position_database
+    if (position_database != None
+        and game_state.number_of_moves == position_database.moves):
+        value = position_database.get(game_state)
+        if value != None:
+            if value <= alpha:
+                return alpha
+            if value >= beta:
+                return beta
+            return value
 
-    # If terminal node.
-    if game_state.can_win_this_move():
-        return 42 - game_state.number_of_moves
-
-    # If not terminal node, but full depth.
-    if game_state.number_of_moves == depth - 1:
+    # If full depth. This is also the case for a full board. The position is then
+    # given a static evaluation, unless it is the last move, which is a draw.
+    if game_state.number_of_moves >= depth - 1:
+        if depth < 42 and search.evaluator != None:
+            return search.evaluator(game_state) / 64
         return 0
 
-    global transposition_table
-
-    moves = [3,2,4,1,5,0,6]
+    # Positions with few empty cells are solved without the overhead of the
+    # transposition table.
+    if depth == 42 and game_state.number_of_moves >= 42 - search.endgame_empty_cells:
+        return endgame_negamax(search, game_state.position, game_state.mask,
+                               game_state.number_of_moves, alpha, beta)
+
+    # If the opponent can make four in a row at more than one position, or if all
+    # moves let the opponent make four in a row, then the opponent wins the next move.
+    # Moves below a position where the opponent can make four in a row are not searched
+    # and if the opponent can make four in a row, only the blocking move is searched.
+    # Because of this, the player in turn can never make four in a row in the child
+    # positions that are searched.
+    position = game_state.position
+    mask = game_state.mask
+    possible_moves = (mask + BOTTOM_ROW) & BOARD
+    opponent_winning_cells = winning_cells(position ^ mask, mask)
+    forced_moves = possible_moves & opponent_winning_cells
+    if forced_moves:
+        if forced_moves & (forced_moves - 1):
+            return -(41 - game_state.number_of_moves)
+        possible_moves = forced_moves
+    possible_moves &= ~(opponent_winning_cells >> 1)
+    if not possible_moves:
+        return -(41 - game_state.number_of_moves)
+
+    # The player in turn can win at the earliest in two moves, and the opponent in
+    # three moves, which bounds the value of the position.
+    max_value = 40 - game_state.number_of_moves
+    if max_value <= alpha:
+        return alpha
+    if max_value < beta:
+        beta = max_value
+    min_value = -(39 - game_state.number_of_moves)
+    if min_value >= beta:
+        return beta
+    if min_value > alpha:
+        alpha = min_value
 
     # Check the transposition table.
-    use_transposition_table = depth > 0
-    if use_transposition_table:
-        key = game_state.key()
-        tt_data = transposition_table.get(key)
-        if tt_data != None:
-            (tt_depth, tt_type, tt_value) = tt_data
-
+    # The number of moves left to the end of the search.
+    draft = depth - game_state.number_of_moves
+    # A position and its mirrored position have the same value, so they share
+    # an entry. Moves in the entry are stored for the position with the lowest hash.
+    key = game_state.canonical_hash()
+    mirrored = game_state.mirror_hash < game_state.hash
+    if VERIFY_TRANSPOSITION_TABLE:
+        position_key = game_state.canonical_key()
+    else:
+        position_key = None
+    tt_entry = transposition_table.get(key, position_key)
+    statistics = search.statistics
+    if statistics != None:
+        statistics.tt_probes += 1
+        if tt_entry:
+            statistics.tt_hits += 1
+    if tt_entry:
+        tt_type = entry_type(tt_entry)
+        tt_value = entry_value(tt_entry)
+
+        # Values are valid for the same or a smaller draft. Other values are only
+        # valid if they are wins or losses, which they are if they are outside of the
+        # range of values the end positions of the search can have.
+        tt_draft = entry_draft(tt_entry)
+        if (tt_draft >= draft
+            or abs(tt_value) >= 42 - game_state.number_of_moves - tt_draft):
             if tt_type == 2:
                 return tt_value
-
-            if tt_value != 0 or tt_depth >= depth:
+            if tt_type == 1:
                 if tt_value >= beta:
                     return beta
-
-    # Else, return a value based on child node values.
-    for move in moves:
-        if game_state.column_height[move] < 6:
+                if tt_value > alpha:
+                    alpha = tt_value
+            else:
+                if tt_value <= alpha:
+                    return alpha
+                if tt_value < beta:
+                    beta = tt_value
+
+        tt_move = entry_move(tt_entry)
+        if tt_move != 7 and mirrored:
+            tt_move = 6 - tt_move
+    else:
+        tt_move = 7
+
+    # The claimeven rule can give an upper bound without a search.
+    if game_state.number_of_moves >= claimeven_min_moves:
+        bound = claimeven_bound(game_state)
+        if bound != None:
+            if bound <= alpha:
+                return alpha
+            if bound < beta:
+                beta = bound
+
+    moves = [move for move in [3,2,4,1,5,0,6] if possible_moves & COLUMNS[move]]
+    if len(moves) > 1:
+        moves = search.move_ordering.order(game_state, moves, draft)
+
+    # The best move from an earlier search is tried first.
+    if tt_move in moves:
+        moves.remove(tt_move)
+        moves.insert(0, tt_move)
+
+    # Enhanced transposition cutoff. If the table has an upper bound for a child
+    # position that gives a beta-cutoff, then the child don't need to be searched.
+    if draft >= etc_min_draft:
+        for move in moves:
             game_state.make_move(move)
-            value = -negamax(game_state, depth, -beta, -alpha)
+            if VERIFY_TRANSPOSITION_TABLE:
+                child_position_key = game_state.canonical_key()
+            else:
+                child_position_key = None
+            child_entry = transposition_table.get(game_state.canonical_hash(),
+                                                  child_position_key)
+            if child_entry and entry_type(child_entry) >= 2:
+                child_value = entry_value(child_entry)
+                child_draft = entry_draft(child_entry)
+                if ((child_draft >= draft - 1
+                     or abs(child_value) >= 42 - game_state.number_of_moves - child_draft)
+                    and -child_value >= beta):
+                    game_state.undo_last_move()
+                    transposition_table.store(key, draft, 1, beta,
+                                              6 - move if mirrored else move, position_key)
+                    if statistics != None:
+                        statistics.etc_cutoffs += 1
+                    return beta
             game_state.undo_last_move()
-            if value >= beta: # Fail hard beta-cutoff.
-                if use_transposition_table:
-                    transposition_table.update({key:(depth, 1, beta)})
+
+    # Principal variation search. The first move is searched with the full window.
+    # The other moves are first searched with a null window, that only tests if the
+    # move is better than alpha, and they are searched again with the full window
+    # if they are. This is only done without a static evaluation, when all values
+    # are integers. With a static evaluation it gives more nodes.
+    principal_variation_search = depth == 42 or search.evaluator == None
+    best_move = 7
+    for move in moves:
+        game_state.make_move(move)
+        if move == moves[0] or not principal_variation_search:
+            value = -negamax(search, game_state, depth, -beta, -alpha)
+        else:
+            value = -negamax(search, game_state, depth, -alpha - 1, -alpha)
+            if alpha < value < beta:
+                value = -negamax(search, game_state, depth, -beta, -alpha)
+        game_state.undo_last_move()
+        if value >= beta: # Fail hard beta-cutoff.
+            if statistics != None:
+                statistics.cutoffs += 1
+                if move == moves[0]:
+                    statistics.first_move_cutoffs += 1
+            search.move_ordering.cutoff(game_state, move, draft)
+            transposition_table.store(key, draft, 1, beta,
+                                      6 - move if mirrored else move, position_key)
+            return beta
+        if value > alpha:
+            alpha = value
+            best_move = move
+
+    if best_move != 7 and mirrored:
+        best_move = 6 - best_move
+    if alpha > original_alpha: # Exact values.
+        transposition_table.store(key, draft, 2, alpha, best_move, position_key)
+    else: # Upper bounds.
+        transposition_table.store(key, draft, 3, alpha, best_move, position_key)
+    return alpha
+
+# The columns in the order they are searched by endgame_negamax.
+ENDGAME_COLUMNS = (COLUMNS[3], COLUMNS[2], COLUMNS[4], COLUMNS[1], COLUMNS[5],
+                   COLUMNS[0], COLUMNS[6])
+
+def endgame_negamax(search, position, mask, number_of_moves, alpha, beta):
+    """Compute the exact value of a position with few empty cells, with the same
+       values as negamax with depth=42. position is the bitboard with the disks of the
+       player in turn and mask the bitboard with all disks. No transposition table
+       is used and no GameState is updated, so that each node is fast.
+       This function can only be used if the player in turn can't make a four in a row
+       this move."""
+    search.nodes += 1
+    if search.nodes >= search.next_budget_check:
+        search.check_budget()
+
+    if number_of_moves >= 41:
+        return 0
+
+    # The same pruning as in negamax.
+    possible_moves = (mask + BOTTOM_ROW) & BOARD
+    opponent_position = position ^ mask
+    opponent_winning_cells = winning_cells(opponent_position, mask)
+    forced_moves = possible_moves & opponent_winning_cells
+    if forced_moves:
+        if forced_moves & (forced_moves - 1):
+            return -(41 - number_of_moves)
+        possible_moves = forced_moves
+    possible_moves &= ~(opponent_winning_cells >> 1)
+    if not possible_moves:
+        return -(41 - number_of_moves)
+
+    # The player in turn can win at the earliest in two moves, and the opponent
+    # in three moves.
+    if 40 - number_of_moves <= alpha:
+        return alpha
+    if 40 - number_of_moves < beta:
+        beta = 40 - number_of_moves
+    if -(39 - number_of_moves) >= beta:
+        return beta
+    if -(39 - number_of_moves) > alpha:
+        alpha = -(39 - number_of_moves)
+
+    for column in ENDGAME_COLUMNS:
+        move = possible_moves & column
+        if move:
+            value = -endgame_negamax(search, opponent_position, mask | move,
+                                     number_of_moves + 1, -beta, -alpha)
+            if value >= beta:
                 return beta
             if value > alpha:
                 alpha = value
-
-    if use_transposition_table:
-        if alpha > original_alpha: # Exact values.
-            if alpha != 0:
-                transposition_table.update({key:(depth, 2, alpha)})
     return alpha
 
-def root_negamax(game_state, move_order, depth, alpha, beta):
+# Enhanced transposition cutoffs are only tried if at least this number of
+# moves are left to the end of the search.
+etc_min_draft = 10
+
+# Searches are only made in parallel if at least this number of moves are left to
+# the end of the search, since smaller searches are faster in one process.
+parallel_min_draft = 12
+
+# The claimeven rule is only tried if at least this number of moves have been made.
+claimeven_min_moves = 16
+
+# With a time limit, level 4 only tries to solve positions where at least this
+# number of moves have been made. Earlier positions are rarely solved in time.
+level_4_solve_min_moves = 12
+
+def root_negamax(search, game_state, move_order, depth, alpha, beta):
+    """Return the first move in move_order with the highest value. The value is stored
+    in search.root_value, which is at most alpha if no move is better than alpha
+    and at least beta if a move is at least as good as beta.
+    """
+    # Principal variation search, as in negamax.
+    principal_variation_search = depth == 42 or search.evaluator == None
+    best_move = move_order[0]
     for move in move_order:
-        game_state.make_move(move)
-        new_value = -negamax(game_state, depth, -beta, -alpha)
-        game_state.undo_last_move()
+        if move == move_order[0] or not principal_variation_search:
+            new_value = root_move_value(search, game_state, move, depth, alpha, beta)
+        else:
+            new_value = root_move_value(search, game_state, move, depth,
+                                        alpha, alpha + 1)
+            if alpha < new_value < beta:
+                new_value = root_move_value(search, game_state, move, depth,
+                                            alpha, beta)
         if new_value > alpha:
             best_move = move
             alpha = new_value
+            if alpha >= beta:
+                break
+    search.root_value = alpha
+    return best_move
+
+def aspiration_root_negamax(search, game_state, move_order, depth):
+    """Return the move computed by root_negamax. If search has an aspiration_window
+    and the score of the previous search is known, the search is first made with a
+    window of that size around the previous score, which gives more cutoffs if the
+    score is inside the window. Else the search is made again with a full window.
+    """
+    if search.aspiration_window != None and search.previous_score != None:
+        alpha = search.previous_score - search.aspiration_window
+        beta = search.previous_score + search.aspiration_window
+        move = root_negamax(search, game_state, move_order, depth, alpha, beta)
+        if alpha < search.root_value < beta:
+            search.previous_score = search.root_value
+            return move
+    move = root_negamax(search, game_state, move_order, depth, -10000, 10000)
+    search.previous_score = search.root_value
+    return move
+
+def root_move_value(search, game_state, move, depth, alpha, beta):
+    """Return the value of move in game_state, computed by negamax."""
+    game_state.make_move(move)
+    if game_state.can_win_this_move():
+        value = -(42 - game_state.number_of_moves)
+    else:
+        value = -negamax(search, game_state, depth, -beta, -alpha)
+    game_state.undo_last_move()
+    return value
+
+def parallel_root_negamax(search, game_state, move_order, depth, alpha, beta):
+    """Return the same move as root_negamax, but use the worker processes of search.
+    The first move is searched in this process. The other moves are then searched in
+    parallel with the value of the first move as alpha, which gives the same best
+    move as when they are searched one at a time.
+    """
+    best_move = move_order[0]
+    value = root_move_value(search, game_state, best_move, depth, alpha, beta)
+    if value > alpha:
+        alpha = value
+    if len(move_order) == 1 or alpha >= beta:
+        search.root_value = alpha
+        return best_move
+
+    moves = game_state.move_history[:game_state.number_of_moves]
+    tasks = [(moves, move, depth, alpha, beta, search.evaluator)
+             for move in move_order[1:]]
+    for (move, (value, nodes)) in zip(move_order[1:],
+                                      search.worker_pool().imap(worker_move_value, tasks)):
+        search.nodes += nodes
+        if value > alpha:
+            best_move = move
+            alpha = value
+    search.root_value = alpha
+    return best_move
+
+# The search state of a worker process, which is kept between the searches so that
+# the transposition table is reused.
+worker_search = None
+
+def start_worker(transposition_table_entries, move_ordering, endgame_empty_cells,
+                 position_database_path):
+    global worker_search
+    position_database = None
+    if position_database_path != None:
+        from position_database import PositionDatabase
+        position_database = PositionDatabase(position_database_path)
+    worker_search = SearchState(TranspositionTable(transposition_table_entries),
+                                move_ordering, position_database=position_database)
+    worker_search.endgame_empty_cells = endgame_empty_cells
+    worker_search.root_moves = None
+
+def worker_move_value(task):
+    """Return the value of a move and the number of searched nodes, computed by a
+    worker process.
+    """
+    (moves, move, depth, alpha, beta, evaluator) = task
+    if moves != worker_search.root_moves:
+        worker_search.root_moves = moves
+        worker_search.new_search()
+    worker_search.evaluator = evaluator
+    worker_search.transposition_table.use_evaluation(evaluation_name(evaluator))
+    worker_search.nodes = 0
+    game_state = GameState()
+    for column in moves:
+        game_state.make_move(column)
+    value = root_move_value(worker_search, game_state, move, depth, alpha, beta)
+    return (value, worker_search.nodes)
+
+def iterative_deepening(search, game_state, move_order, depth):
+    """Return a move computed by root_negamax with increasing depths, up to depth or
+    until the budget of search runs out. The transposition table is kept between
+    the depths and the best move from one depth is searched first at the next depth.
+    The move from the deepest completed search is returned, or the first move in
+    move_order if no search was completed. If the search is stopped with
+    SearchState.stop, SearchAborted is raised instead.
+    """
+    number_of_moves = game_state.number_of_moves
+    best_move = move_order[0]
+    for d in range(number_of_moves + 2, depth + 1):
+        start_time = time.perf_counter()
+        start_nodes = search.nodes
+        try:
+            best_move = aspiration_root_negamax(search, game_state, move_order, d)
+            if search.statistics != None:
+                search.statistics.add_depth(d - number_of_moves,
+                                            search.nodes - start_nodes,
+                                            time.perf_counter() - start_time)
+        except SearchAborted:
+            # Undo the moves of the aborted search.
+            while game_state.number_of_moves > number_of_moves:
+                game_state.undo_last_move()
+            if search.stopped:
+                raise
+            break
+        move_order = [best_move] + [move for move in move_order if move != best_move]
     return best_move
 
-def computer_move(game_state, depth, heuristic_function):
+def computer_move(search, game_state, depth, heuristic_function):
     """Return a move computed by using the minimax algorithm
     and heuristic evaluations.
     """
@@ -449,7 +1342,7 @@ def computer_move(game_state, depth, heuristic_function):
     # more varied. Shuffling take longer time, maybe because of less optimal usage of
     # the transposition table, but it anyway appear to give a stronger engine, even if
     # the depth level is lowered.
-    random.shuffle(available_moves)
+    search.random.shuffle(available_moves)
 
     def search_key(move):
         return heuristic_function(game_state, move)
@@ -470,21 +1363,560 @@ def computer_move(game_state, depth, heuristic_function):
     if game_state.number_of_moves <= 40:
         move_list = blocking_moves(game_state)
         if move_list:
-            return heuristic_move(game_state, move_list, heuristic_function)
+            return heuristic_move(search, game_state, move_list, heuristic_function)
 
     alpha = -10000
     beta = 10000
 
-#    # Iterative deepening.
-#    if depth == 42:
-#        available_moves = [move for move in [3,2,4,1,5,0,6] if game_state.column_height[move] < 6]
-#        for d in range(game_state.number_of_moves + 2, depth):
-#            best_move = root_negamax(game_state, available_moves, d, alpha, beta)
-#            available_moves = [best_move] + [move for move in [3,2,4,1,5,0,6]
-#                              if game_state.column_height[move] < 6 and move != best_move]
+    search.new_search()
 
-    return root_negamax(game_state, available_moves, depth, alpha, beta)
+    # In a symmetric position a move and its mirrored move have the same value,
+    # so only the moves in the middle and the left half are searched.
+    symmetric = game_state.key() == game_state.mirror_key()
+    if symmetric:
+        available_moves = [move for move in available_moves if move <= 3]
 
-def reset_transposition_table():
-    global transposition_table
-    transposition_table = dict()
+    start_time = time.perf_counter()
+    start_nodes = search.nodes
+    if search.has_budget():
+        move = iterative_deepening(search, game_state, available_moves, depth)
+    else:
+        if search.workers > 1 and depth - game_state.number_of_moves >= parallel_min_draft:
+            move = parallel_root_negamax(search, game_state, available_moves, depth,
+                                         alpha, beta)
+        else:
+            move = aspiration_root_negamax(search, game_state, available_moves, depth)
+        if search.statistics != None:
+            search.statistics.add_depth(depth - game_state.number_of_moves,
+                                        search.nodes - start_nodes,
+                                        time.perf_counter() - start_time)
+    if symmetric and search.random.random() < 0.5:
+        move = 6 - move
+    return move
+
+def solve(search, game_state):
+    """Return the score of game_state for the player in turn with perfect play, on the
+    same scale as negamax. The score is found with null window searches, where each
+    search tells if the score is above or below a value. The searches are made in a
+    binary search over the possible scores. This function can only be used if the
+    game state have no four in a row.
+    """
+    if game_state.can_win_this_move():
+        return 42 - game_state.number_of_moves
+    if game_state.number_of_moves >= 41:
+        return 0
+
+    # The opponent can at the earliest win the next move and the player in turn can
+    # at the earliest win the move after that.
+    min_score = -(41 - game_state.number_of_moves)
+    max_score = 40 - game_state.number_of_moves
+
+    while min_score < max_score:
+        middle = (min_score + max_score) // 2
+        # Values closer to 0 are tested first, since such searches are faster.
+        if middle <= 0 and min_score // 2 < middle:
+            middle = min_score // 2
+        elif middle >= 0 and max_score // 2 > middle:
+            middle = max_score // 2
+        value = negamax(search, game_state, 42, middle, middle + 1)
+        if value <= middle:
+            max_score = value
+        else:
+            min_score = value
+    return min_score
+
+class StaticMoveOrdering:
+    """A move ordering policy where the moves are searched in a fixed order, with
+    central columns first.
+    """
+    def order(self, game_state, moves, draft):
+        """Return the list moves in the order the moves should be searched in
+        game_state. moves are given in the order 3, 2, 4, 1, 5, 0, 6. draft is the
+        number of moves left to the end of the search.
+        """
+        return moves
+
+    def cutoff(self, game_state, move, draft):
+        """Called when move gave a beta-cutoff in game_state."""
+        pass
+
+    def new_search(self):
+        """Called before each search for a move."""
+        pass
+
+    def clear(self):
+        """Called when a new game is started."""
+        pass
+
+class DynamicMoveOrdering(StaticMoveOrdering):
+    """A move ordering policy that orders the moves by
+
+    1. the number of positions where the player in turn can make four in a row
+       after the move, since such threats often force the opponent,
+    2. killer moves, which are the last two moves that gave a beta-cutoff at the same
+       move number,
+    3. the history heuristic, which is a sum over all beta-cutoffs given by moves to
+       the same position by the same player, weighted by the squared draft,
+    4. the fixed order of StaticMoveOrdering.
+
+    Counting threats is slow compared to the rest of a node, so it is only made when
+    at least threat_min_draft moves are left to the end of the search. Tests show
+    that threats reduce the number of nodes a lot when solving positions, but that
+    killer moves and the history heuristic increase it, so they are not used by
+    default.
+    """
+    def __init__(self, threats=True, killer_moves=False, history=False,
+                 threat_min_draft=10):
+        self.threats = threats
+        self.killer_moves = killer_moves
+        self.use_history = history
+        self.threat_min_draft = threat_min_draft
+        self.clear()
+
+    def order(self, game_state, moves, draft):
+        count_threats = self.threats and draft >= self.threat_min_draft
+        if not (count_threats or self.killer_moves or self.use_history):
+            return moves
+
+        killers = self.killers[game_state.number_of_moves]
+        history = self.history[game_state.number_of_moves % 2]
+        position = game_state.position
+        mask = game_state.mask
+        scores = [0, 0, 0, 0, 0, 0, 0]
+        for move in moves:
+            cell = move * 7 + game_state.column_height[move]
+            score = 0
+            if self.use_history:
+                score = min(history[cell], 0xffff)
+            if self.killer_moves:
+                if cell == killers[0]:
+                    score += 0x20000
+                elif cell == killers[1]:
+                    score += 0x10000
+            if count_threats:
+                threats = winning_cells(position | 1 << cell, mask | 1 << cell)
+                score += bin(threats).count("1") << 18
+            scores[move] = score
+        moves.sort(key=scores.__getitem__, reverse=True)
+        return moves
+
+    def cutoff(self, game_state, move, draft):
+        # Killer moves and history are stored for positions on the board rather than
+        # columns, since the same column is often a different move in other positions.
+        cell = move * 7 + game_state.column_height[move]
+        killers = self.killers[game_state.number_of_moves]
+        if killers[0] != cell:
+            killers[1] = killers[0]
+            killers[0] = cell
+        self.history[game_state.number_of_moves % 2][cell] += draft * draft
+
+    def new_search(self):
+        # Old history values are given less weight.
+        for history in self.history:
+            for cell in range(49):
+                history[cell] //= 2
+
+    def clear(self):
+        self.killers = [[None, None] for number_of_moves in range(43)]
+        self.history = [[0] * 49 for player in range(2)]
+
+# The file the programs save the transposition table to between sessions.
+TRANSPOSITION_TABLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                        "transposition_table.bin")
+
+class TranspositionTable:
+    """A transposition table with a fixed number of entries, so that the memory usage
+    is bounded. The table is preallocated as an array of 64 bit words, with one word
+    for each entry. The bits of an entry are used as follows.
+
+    bits 0-12   64 * value + 4096, since values are multiples of 1/64
+    bits 13-14  type, 1 for a lower bound, 2 for an exact value, 3 for an upper bound
+                and 0 for no entry
+    bits 15-20  draft, the number of moves that was left to the end of the search
+    bits 21-23  the best move, or 7 if there is no best move
+    bits 24-26  the search generation the entry was stored in, modulo 8
+    bits 27-63  the highest 37 bits of the 64 bit key, used to verify the entry
+
+    The entries are stored in buckets of two. The first entry in a bucket is only
+    replaced by an entry with at least the same draft, or if it was stored in an
+    earlier search. The second entry is always replaced.
+
+    Values that are not proven depend on the static evaluation of the search, so
+    the table is only used by searches with one static evaluation at a time. Its
+    name is self.evaluation, and it is None for an empty table.
+    """
+    bytes_per_entry = 8
+
+    def __init__(self, max_entries=1 << 20, max_bytes=None):
+        """The size of the table is max_entries, or the number of entries that fit in
+        max_bytes if it is given.
+        """
+        if max_bytes != None:
+            max_entries = max_bytes // self.bytes_per_entry
+        self.number_of_buckets = max(max_entries // 2, 1)
+        self.clear()
+
+    def clear(self):
+        size = 2 * self.number_of_buckets
+        self.entries = array.array("Q", bytes(self.bytes_per_entry * size))
+        if VERIFY_TRANSPOSITION_TABLE:
+            self.position_keys = [None] * size
+        self.generation = 0
+        self.number_of_entries = 0
+        self.stores = 0
+        self.evictions = 0
+        self.evaluation = None
+
+    def use_evaluation(self, name):
+        """Prepare the table for searches with the static evaluation with the name
+        name, given by evaluation_name. The table is cleared if its entries were
+        stored with another static evaluation.
+        """
+        if self.evaluation != name:
+            if self.number_of_entries:
+                self.clear()
+            self.evaluation = name
+
+    def new_search(self):
+        """Make the entries stored so far replaceable by new entries of any draft."""
+        self.generation = (self.generation + 1) & 7
+
+    def get(self, key, position_key=None):
+        """Return the entry for key as a word, or 0 if there is no such entry.
+        The fields can be extracted with the functions entry_draft, entry_type,
+        entry_value and entry_move.
+        """
+        index = 2 * (key % self.number_of_buckets)
+        check = key >> 27
+        entry = self.entries[index]
+        if entry >> 27 != check:
+            index += 1
+            entry = self.entries[index]
+            if entry >> 27 != check:
+                return 0
+        if entry and VERIFY_TRANSPOSITION_TABLE:
+            assert self.position_keys[index] == position_key, \
+                "Hash collision in the transposition table"
+        return entry
+
+    def store(self, key, draft, type_, value, move, position_key=None):
+        index = 2 * (key % self.number_of_buckets)
+        check = key >> 27
+        entries = self.entries
+        first_entry = entries[index]
+        if (first_entry and first_entry >> 27 != check
+            and (first_entry >> 24) & 7 == self.generation
+            and draft < (first_entry >> 15) & 63):
+            index += 1
+        elif entries[index + 1] and entries[index + 1] >> 27 == check:
+            # The entry is moved to the first place in the bucket.
+            entries[index + 1] = 0
+            self.number_of_entries -= 1
+
+        if not entries[index]:
+            self.number_of_entries += 1
+        elif entries[index] >> 27 != check:
+            self.evictions += 1
+        entries[index] = (check << 27 | self.generation << 24 | move << 21 | draft << 15
+                          | type_ << 13 | round(64 * value) + 4096)
+        if VERIFY_TRANSPOSITION_TABLE:
+            self.position_keys[index] = position_key
+        self.stores += 1
+
+    # The header of a saved table has a magic number, the version of the file format,
+    # the number of buckets and the number of saved entries. The version must be
+    # changed when the content of the entries is changed.
+    file_header = struct.Struct("<4sIII32s")
+    file_magic = b"4RWT"
+    file_version = 2
+
+    def save(self, path, min_draft=8):
+        """Save the entries with at least the draft min_draft to the file path. The
+        file has a header with the name of the static evaluation of the entries,
+        followed by the indices of the entries as 32 bit integers and the entries as
+        64 bit words, all little-endian.
+        """
+        indices = array.array("I")
+        words = array.array("Q")
+        for (index, entry) in enumerate(self.entries):
+            if entry and (entry >> 15) & 63 >= min_draft:
+                indices.append(index)
+                words.append(entry)
+        if sys.byteorder == "big":
+            indices.byteswap()
+            words.byteswap()
+
+        # The file is written to a temporary file first, so that a file is never
+        # partly written.
+        with open(path + ".tmp", "wb") as f:
+            f.write(self.file_header.pack(self.file_magic, self.file_version,
+                                          self.number_of_buckets, len(words),
+                                          (self.evaluation or "").encode()))
+            indices.tofile(f)
+            words.tofile(f)
+        os.replace(path + ".tmp", path)
+
+    def load(self, path):
+        """Add the entries saved with save to the table. Raise OSError if the file
+        can't be read and ValueError if it was saved by another version of the table
+        or by a table of another size. The table is cleared first if its entries were
+        stored with another static evaluation than the ones in the file.
+        """
+        with open(path, "rb") as f:
+            data = f.read()
+        if len(data) < self.file_header.size:
+            raise ValueError("Not a transposition table file: " + path)
+        (magic, version, number_of_buckets, size,
+         evaluation) = self.file_header.unpack_from(data)
+        if (magic != self.file_magic or version != self.file_version
+            or number_of_buckets != self.number_of_buckets
+            or len(data) != self.file_header.size + 12 * size):
+            raise ValueError("Not a transposition table file of version %d "
+                             "for this table size: %s" % (self.file_version, path))
+
+        # The keys of the positions are not saved, so the table can't be checked.
+        if VERIFY_TRANSPOSITION_TABLE:
+            return
+        if size == 0:
+            return
+        self.use_evaluation(evaluation.rstrip(b"\0").decode())
+        indices = array.array("I")
+        indices.frombytes(data[self.file_header.size:self.file_header.size + 4 * size])
+        words = array.array("Q")
+        words.frombytes(data[self.file_header.size + 4 * size:])
+        if sys.byteorder == "big":
+            indices.byteswap()
+            words.byteswap()
+        entries = self.entries
+        for (index, entry) in zip(indices, words):
+            if not entries[index]:
+                self.number_of_entries += 1
+            entries[index] = entry
+
+    def statistics(self):
+        """Return a dictionary with the size and usage of the table."""
+        capacity = 2 * self.number_of_buckets
+        return {"capacity": capacity,
+                "bytes": capacity * self.bytes_per_entry,
+                "entries": self.number_of_entries,
+                "occupancy": self.number_of_entries / capacity,
+                "stores": self.stores,
+                "evictions": self.evictions}
+
+def entry_draft(entry):
+    return (entry >> 15) & 63
+
+def entry_type(entry):
+    return (entry >> 13) & 3
+
+def entry_value(entry):
+    value = (entry & 8191) - 4096
+    if value & 63:
+        return value / 64
+    return value >> 6
+
+def entry_move(entry):
+    return (entry >> 21) & 7
+
+def evaluation_name(evaluator):
+    """Return the name of a static evaluation function for the transposition table,
+    or "" for searches without static evaluation.
+    """
+    if evaluator == None:
+        return ""
+    return evaluator.__name__
+
+class SearchState:
+    """The state that is kept between the searches of an engine. It is passed to the
+    search functions, so that several engines can be used in the same process.
+    """
+    def __init__(self, transposition_table, move_ordering=None, evaluator=None,
+                 position_database=None):
+        """move_ordering is an object with the methods of DynamicMoveOrdering, which
+        is used if it is not given. evaluator is a static evaluation function like
+        threat_evaluation, or None if positions at the end of the search are given
+        the value 0.
+
+        Positions with at most endgame_empty_cells empty cells are solved with
+        endgame_negamax when the search goes to the end of the game.
+
+        position_database is a PositionDatabase, or None. Positions in the database
+        are given their score from the database instead of being searched.
+
+        If workers is larger than 1, computer_move searches the moves in parallel in a
+        pool of that many processes, which is started when it is first needed.
+        close() stops the processes.
+
+        If aspiration_window is not None, the searches at the root are first made
+        with a window of that size around previous_score, the score of the previous
+        search.
+
+        statistics is a SearchStatistics that the searches count in, or None if no
+        statistics are collected.
+
+        random is the random.Random used for the random choices of the searches.
+        """
+        self.transposition_table = transposition_table
+        if move_ordering == None:
+            move_ordering = DynamicMoveOrdering()
+        self.move_ordering = move_ordering
+        self.evaluator = evaluator
+        self.position_database = position_database
+        self.endgame_empty_cells = 12
+        self.workers = 1
+        self.worker_transposition_table_entries = 1 << 20
+        self.pool = None
+        self.aspiration_window = None
+        self.previous_score = None
+        self.root_value = None
+        self.stopped = False
+        self.statistics = None
+        self.random = random.Random()
+        self.nodes = 0
+        self.set_budget()
+
+    def worker_pool(self):
+        """Return a pool of worker processes, which is started the first time it
+        is needed.
+        """
+        if self.pool == None:
+            if self.position_database == None:
+                position_database_path = None
+            else:
+                position_database_path = self.position_database.path
+            self.pool = multiprocessing.Pool(
+                self.workers, start_worker,
+                (self.worker_transposition_table_entries, self.move_ordering,
+                 self.endgame_empty_cells, position_database_path))
+        return self.pool
+
+    def close(self):
+        """Stop the worker processes."""
+        if self.pool != None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def new_search(self):
+        """Called before each search for a move."""
+        self.transposition_table.new_search()
+        self.move_ordering.new_search()
+
+    def set_budget(self, time_limit_ms=None, max_nodes=None):
+        """Limit the searches from now on to time_limit_ms milliseconds and max_nodes
+        searched nodes. None means no limit.
+        """
+        self.max_nodes = max_nodes
+        if time_limit_ms == None:
+            self.deadline = None
+        else:
+            self.deadline = time.perf_counter() + time_limit_ms / 1000
+        if self.has_budget():
+            self.next_budget_check = self.nodes
+        else:
+            self.next_budget_check = sys.maxsize
+        # stop can be called from another thread, so stopped is read after
+        # next_budget_check is written. A stop made before the write is then seen
+        # here and a stop made after it resets next_budget_check.
+        if self.stopped:
+            self.next_budget_check = 0
+
+    def has_budget(self):
+        return self.deadline != None or self.max_nodes != None
+
+    def stop(self):
+        """Make the search that uses this state stop as soon as possible, by raising
+        SearchAborted. It can be called from another thread.
+        """
+        self.stopped = True
+        self.next_budget_check = 0
+
+    def check_budget(self):
+        """Raise SearchAborted if the budget is used up or stop has been called.
+        Called by negamax every budget_check_interval nodes.
+        """
+        if self.stopped:
+            raise SearchAborted()
+        if self.max_nodes != None and self.nodes >= self.max_nodes:
+            raise SearchAborted()
+        if self.deadline != None and time.perf_counter() >= self.deadline:
+            raise SearchAborted()
+        self.next_budget_check = self.nodes + self.budget_check_interval
+        if self.max_nodes != None:
+            self.next_budget_check = min(self.next_budget_check, self.max_nodes)
+
+    budget_check_interval = 512
+
+
+class SearchStatistics:
+    """Counters of the searches for one or more moves. The nodes searched by endgame
+    negamax and by worker processes are included in nodes, but are not counted in
+    the other counters.
+
+    moves               the number of engine moves
+    book_moves          moves taken from the opening book
+    ponder_moves        moves taken from the searches made while pondering
+    nodes               searched nodes
+    seconds             the time for the moves
+    tt_probes           transposition table lookups in negamax
+    tt_hits             lookups that found an entry
+    tt_stores           entries stored in the transposition table
+    cutoffs             beta-cutoffs in negamax
+    first_move_cutoffs  beta-cutoffs by the first searched move
+    etc_cutoffs         enhanced transposition cutoffs
+    depths              a dictionary from the number of moves searched ahead to a list
+                        with the number of completed searches to that depth, their
+                        nodes and their time in seconds
+    """
+    counters = ["moves", "book_moves", "ponder_moves", "nodes", "seconds", "tt_probes",
+                "tt_hits", "tt_stores", "cutoffs", "first_move_cutoffs", "etc_cutoffs"]
+
+    def __init__(self):
+        for counter in self.counters:
+            setattr(self, counter, 0)
+        self.depths = {}
+
+    def add_depth(self, draft, nodes, seconds):
+        """Count a completed search draft moves ahead."""
+        searches = self.depths.setdefault(draft, [0, 0, 0])
+        searches[0] += 1
+        searches[1] += nodes
+        searches[2] += seconds
+
+    def add(self, statistics):
+        """Add the counters of another SearchStatistics to these counters."""
+        for counter in self.counters:
+            setattr(self, counter, getattr(self, counter) + getattr(statistics, counter))
+        for (draft, (searches, nodes, seconds)) in statistics.depths.items():
+            totals = self.depths.setdefault(draft, [0, 0, 0])
+            totals[0] += searches
+            totals[1] += nodes
+            totals[2] += seconds
+
+    def as_dict(self):
+        """Return a dictionary with the counters and the rates computed from them."""
+        statistics = {counter: getattr(self, counter) for counter in self.counters}
+        statistics["depths"] = {draft: tuple(searches)
+                                for (draft, searches) in sorted(self.depths.items())}
+        statistics["nodes_per_second"] = self.nodes / self.seconds if self.seconds else 0
+        statistics["tt_hit_rate"] = self.tt_hits / self.tt_probes if self.tt_probes else 0
+        statistics["first_move_cutoff_rate"] = (self.first_move_cutoffs / self.cutoffs
+                                                if self.cutoffs else 0)
+        return statistics
+
+    def __str__(self):
+        statistics = self.as_dict()
+        text = ("%d moves (%d book, %d ponder), %d nodes, %.3f s, %.0f nodes/s, "
+                "tt hits %.1f%%, %d stores, first move cutoffs %.1f%%"
+                % (self.moves, self.book_moves, self.ponder_moves, self.nodes,
+                   self.seconds, statistics["nodes_per_second"],
+                   100 * statistics["tt_hit_rate"], self.tt_stores,
+                   100 * statistics["first_move_cutoff_rate"]))
+        for (draft, (searches, nodes, seconds)) in statistics["depths"].items():
+            text += ", depth %d: %d nodes %.3f s" % (draft, nodes, seconds)
+        return text
+
+
+class SearchAborted(Exception):
+    """Raised by negamax when the budget of the search is used up."""
+    pass
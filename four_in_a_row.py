@@ -1,6 +1,13 @@
+import argparse
+import queue
+import threading
 import tkinter as tk
 from engine import EngineInterface
 from engine import GameState
+from engine import SearchAborted
+from engine import TRANSPOSITION_TABLE_PATH
+from opening_book import open_book
+from position_database import open_database
 
 
 class MainWindow(tk.Tk):
@@ -8,7 +15,8 @@ class MainWindow(tk.Tk):
     def __init__(self):
         tk.Tk.__init__(self)
         self.resizable(False, False)
-        self.board = Board(self)
+        self.scheduler = Scheduler(self)
+        self.board = Board(self, self.scheduler)
         self.board.pack()
         self.player_color = "yellow"
         self.engine_color = "red"
@@ -21,6 +29,12 @@ class MainWindow(tk.Tk):
         self.title("Four in a row: 0 - 0")
         self.animations = False
 
+        # The engine searches in a worker thread, that puts the move in a queue,
+        # which is polled with after.
+        self.engine_moves = queue.Queue()
+        self.search_thread = None
+        self.poll_id = None
+
     def new_game_dialog_box(self):
         self.protocol("WM_DELETE_WINDOW", self.dont_close_window) # Disable close window
         dialog_box = DialogBox(main_window, "New game")
@@ -41,6 +55,8 @@ class MainWindow(tk.Tk):
             engine_interface.difficulty_level = 2
         elif self.difficulty_level.get() == "Hard":
             engine_interface.difficulty_level = 3
+        elif self.difficulty_level.get() == "Expert":
+            engine_interface.difficulty_level = 4
         if engine_interface.difficulty_level != current_level:
             self.score = [0, 0]
             self.title_update()
@@ -48,229 +64,261 @@ class MainWindow(tk.Tk):
     def title_update(self):
         self.title("Four in a row: " + str(self.score[0]) + " - " + str(self.score[1]))
 
-    def update_and_pause(self, time_in_ms):
-        self.board.unbind_mouse()
-        self.update_idletasks()
-        self.after(time_in_ms)
-        self.update() # Handle possible events.
-        self.board.rebind_mouse()
+    def dialog(self, text):
+        dialog_box = DialogBox(main_window, text)
+        if self.new_game_flag:
+            self.new_game()
+        else:
+            self.close_window()
 
     def mouse_click(self, column_number):
         """This function is called if the column with column_number have been
         clicked on.
         """
-        def dialog(text):
-            dialog_box = DialogBox(main_window, text)
-            if self.new_game_flag:
-                self.protocol("WM_DELETE_WINDOW", self.close_window) # Enable close window
-                self.new_game()
-            else:
-                self.destroy()
-
-        self.protocol("WM_DELETE_WINDOW", self.dont_close_window) # Disable close window
+        # The player can't move while the engine is searching or a disk is moving.
+        if self.search_thread != None or self.scheduler.busy():
+            return
 
         # Player make a move, if there is empty places left in the column.
-        if engine_interface.legal(column_number):
-            engine_interface.make_move(column_number)
-            self.board.add_disk_to_top_of_column(column_number, self.player_color, self.animations)
-            self.update_idletasks()
-        else:
-            self.protocol("WM_DELETE_WINDOW", self.close_window) # Enable close window
+        if not engine_interface.legal(column_number):
             return
+        engine_interface.make_move(column_number)
+        self.board.add_disk_to_top_of_column(column_number, self.player_color, self.animations)
 
         # If player win.
         if engine_interface.four_in_a_row():
             self.score[0] += 1
             self.title_update()
             self.highlight_four_in_a_row(self.player_color)
-            self.update_and_pause(1000)
-            dialog("You win! Congratulations!")
+            self.scheduler.run([(1000, lambda: self.dialog("You win! Congratulations!"))])
             return
 
         # If draw.
         if engine_interface.draw():
-            self.update_and_pause(600)
-            dialog("Draw")
+            self.scheduler.run([(600, lambda: self.dialog("Draw"))])
             return
 
-        # Engine makes a move
-        column_number = engine_interface.engine_move()
+        # The engine searches while the disk of the player is moving.
+        self.start_engine_search()
+
+    def start_engine_search(self):
+        """Start a search for an engine move in a worker thread."""
+        self.search_thread = threading.Thread(target=self.engine_search, daemon=True)
+        self.search_thread.start()
+        self.poll_id = self.after(20, self.poll_engine_move)
+
+    def engine_search(self):
+        """Called in the worker thread."""
+        try:
+            self.engine_moves.put(engine_interface.engine_move())
+        except SearchAborted:
+            pass
+
+    def poll_engine_move(self):
+        """Make the engine move when the search and the animations are finished."""
+        if self.scheduler.busy() or self.engine_moves.empty():
+            self.poll_id = self.after(20, self.poll_engine_move)
+            return
+        column_number = self.engine_moves.get_nowait()
+        self.poll_id = None
+        self.search_thread.join()
+        self.search_thread = None
+        self.engine_move(column_number)
+
+    def cancel_engine_search(self):
+        """Stop a search that is running and wait for the worker thread to stop."""
+        if self.search_thread != None:
+            engine_interface.stop_search()
+            self.search_thread.join()
+            self.search_thread = None
+            self.after_cancel(self.poll_id)
+            self.poll_id = None
+            while not self.engine_moves.empty():
+                self.engine_moves.get_nowait()
+
+    def engine_move(self, column_number):
+        if arguments.stats:
+            print(engine_interface.statistics_report())
         engine_interface.make_move(column_number)
         if self.animations:
-            self.update_and_pause(50)
+            pause = 50
         else:
-            self.update_and_pause(300)
-        self.board.add_disk_to_top_of_column(column_number, self.engine_color, self.animations)
+            pause = 300
+        self.board.add_disk_to_top_of_column(column_number, self.engine_color,
+                                             self.animations, pause)
 
         # If engine win.
         if engine_interface.four_in_a_row():
             self.score[1] += 1
-            self.title_update()
+            self.scheduler.run([(0, self.title_update)])
             self.highlight_four_in_a_row(self.engine_color)
-            self.update_and_pause(1000)
-            dialog("Computer win!")
+            self.scheduler.run([(1000, lambda: self.dialog("Computer win!"))])
             return
 
         # If draw.
         if engine_interface.draw():
-            self.update_and_pause(600)
-            dialog("Draw")
+            self.scheduler.run([(600, lambda: self.dialog("Draw"))])
             return
 
-        self.protocol("WM_DELETE_WINDOW", self.close_window) # Enable close window
+        # The engine searches while the player thinks.
+        engine_interface.start_pondering()
 
     def highlight_four_in_a_row(self, color):
+        """Make the disks in the four in a row blink once, after the animations
+        that are running.
+        """
         positions = engine_interface.four_in_a_row_positions()
-        self.update_and_pause(500)
-        for (column, row) in positions:
-            self.board.remove_disk(column, row)
-        self.update_and_pause(500)
-        for (column, row) in positions:
-            self.board.add_disk(column, row, color)
+
+        def remove_disks():
+            for (column, row) in positions:
+                self.board.remove_disk(column, row)
+
+        def add_disks():
+            for (column, row) in positions:
+                self.board.add_disk(column, row, color)
+
+        self.scheduler.run([(500, remove_disks), (500, add_disks)])
 
     def new_game(self):
+        self.cancel_engine_search()
+        self.scheduler.cancel()
         self.new_game_flag = False
         self.player_make_first_move = not self.player_make_first_move
         engine_interface.new_game()
         self.board.remove_all_disks()
 
         if not self.player_make_first_move:
-            column_number = engine_interface.engine_move()
-            engine_interface.make_move(column_number)
-            self.update_and_pause(300)
-            self.board.add_disk_to_top_of_column(column_number, self.engine_color, self.animations)
+            self.start_engine_search()
 
     def dont_close_window(self):
         pass
 
     def close_window(self):
+        self.cancel_engine_search()
+        self.scheduler.cancel()
         self.destroy()
 
 
-class Board(tk.Frame):
-    def __init__(self, parent):
-        tk.Frame.__init__(self, parent)
-        self.parent = parent
-        self.column_list = []
-        for column_number in range(7):
-            column = Column(self, column_number)
-            column.pack(side=tk.LEFT)
-            self.column_list.append(column)
-
-    def mouse_click(self, column_number):
-        self.parent.mouse_click(column_number)
-
-    def add_disk_to_top_of_column(self, column_number, color, animations):
-        """column_number is 0,1 to 6. animations is True or False."""
-        self.column_list[column_number].add_disk_to_top_of_column(color, animations)
-
-    def add_disk(self, column, row, color):
-        self.column_list[column].add_disk(row, color)
-
-    def remove_disk(self, column, row):
-        self.column_list[column].remove_disk(row)
-
-    def remove_all_disks(self):
-        for column in self.column_list:
-            column.remove_all_disks()
-
-    def unbind_mouse(self):
-        for column in self.column_list:
-            column.unbind_mouse()
-
-    def rebind_mouse(self):
-       for column in self.column_list:
-            column.rebind_mouse()
-
-
-class Column(tk.Frame):
-    def __init__(self, parent, column_number):
-        """column_number is 0,1 to 6 and is used as an identifier."""
-        tk.Frame.__init__(self, parent)
-        self.parent = parent
-        self.column_number = column_number
-        self.disks_in_column = 0
-        self.column = []
-        for cell in range(6):
-            new_cell = Cell(self, 90)
-            new_cell.pack(side=tk.BOTTOM)
-            self.column.append(new_cell)
-
-    def mouse_click(self, event):
-        self.parent.mouse_click(self.column_number)
-
-    def add_disk_to_top_of_column(self, color, animations):
-        """animations is True or False."""
-        if animations:
-            time_in_each_row = [0.41421356237309515, 0.31783724519578205, 0.2679491924311228,
-                                0.2360679774997898, 0.21342176528338808]
-            total_time = 0
-            min_time = 170
-            self.add_disk(5, color)
-            self.update_idletasks()
-            row = 4
-            while row >= self.disks_in_column:
-                pause_time = round(170*time_in_each_row[row])
-                self.after(pause_time)
-                total_time += pause_time
-                self.remove_disk(row + 1)
-                self.add_disk(row, color)
-                self.update_idletasks()
-                row -=1
-            if total_time < min_time:
-                self.after(min_time - total_time)
-        else:
-            self.add_disk(self.disks_in_column, color)
-        self.disks_in_column += 1
-
-    def add_disk(self, row, color):
-        self.column[row].add_disk(color)
-
-    def remove_disk(self, row):
-        self.column[row].remove_disk()
-
-    def remove_all_disks(self):
-        self.disks_in_column = 0
-        for cell in self.column:
-            cell.remove_disk()
-
-    def unbind_mouse(self):
-        for cell in self.column:
-            cell.unbind_mouse()
-
-    def rebind_mouse(self):
-        for cell in self.column:
-            cell.rebind_mouse()
-
-
-class Cell(tk.Canvas):
-
-    def __init__(self, parent, side_length):
-        """A cell is the a square-shaped piece of the board consisting of
-        one empty space where a disk can be placed.
+class Scheduler:
+    """Runs steps one after another without blocking the event loop. A step is a
+    pair (pause, function), where function is called pause milliseconds after the
+    previous step. The steps are chained with after(ms, callback).
+    """
+    def __init__(self, widget):
+        self.widget = widget
+        self.steps = []
+        self.after_id = None
+        self.running_step = False
+
+    def run(self, steps):
+        """Run steps after the steps that are already waiting."""
+        self.steps.extend(steps)
+        if self.after_id == None and not self.running_step:
+            self.schedule_next_step()
+
+    def busy(self):
+        return self.after_id != None or self.running_step
+
+    def cancel(self):
+        """Remove all steps that are waiting."""
+        self.steps = []
+        if self.after_id != None:
+            self.widget.after_cancel(self.after_id)
+            self.after_id = None
+
+    def schedule_next_step(self):
+        if self.steps:
+            (pause, function) = self.steps[0]
+            self.after_id = self.widget.after(pause, self.run_next_step)
+
+    def run_next_step(self):
+        self.after_id = None
+        (pause, function) = self.steps.pop(0)
+        self.running_step = True
+        try:
+            function()
+        finally:
+            self.running_step = False
+        if self.after_id == None:
+            self.schedule_next_step()
+
+
+class Board(tk.Canvas):
+    def __init__(self, parent, scheduler, side_length=90):
+        """The board is drawn on one canvas, where each of the 42 empty spaces is
+        a circle that is filled with the color of a disk. scheduler is the
+        Scheduler that runs the animations.
         """
-        self.parent = parent
         self.background_color = "#1439f9"
-        tk.Canvas.__init__(self, parent, width=side_length, height=side_length,
+        tk.Canvas.__init__(self, parent, width=7 * side_length, height=6 * side_length,
                            bg=self.background_color, highlightthickness=0)
+        self.parent = parent
+        self.scheduler = scheduler
+        self.side_length = side_length
+        self.disks_in_column = [0] * 7
+
         # An odd diameter can give a better looking circle.
         radius = (9 * side_length) // 20
         d = (side_length - (2 * radius + 1)) // 2
-        self.disk = self.create_oval(d, d, d + 2 * radius + 1, d + 2 * radius + 1,
-                                     width=2, outline="#0000AA")
-        self.bind("<Button-1>", parent.mouse_click)
+        self.disks = []
+        for column in range(7):
+            column_disks = []
+            for row in range(6):
+                x = column * side_length + d
+                y = (5 - row) * side_length + d
+                column_disks.append(self.create_oval(x, y, x + 2 * radius + 1,
+                                                     y + 2 * radius + 1, width=2,
+                                                     outline="#0000AA"))
+            self.disks.append(column_disks)
+        self.bind("<Button-1>", self.mouse_click)
 
-    def add_disk(self, color):
-        self.itemconfig(self.disk, fill=color)
+    def mouse_click(self, event):
+        column_number = event.x // self.side_length
+        if 0 <= column_number < 7:
+            self.parent.mouse_click(column_number)
 
-    def remove_disk(self):
-        self.itemconfig(self.disk, fill=self.background_color)
+    def add_disk_to_top_of_column(self, column_number, color, animations, pause=0):
+        """Add a disk after pause milliseconds and the animations that are running.
+        column_number is 0,1 to 6. animations is True or False.
+        """
+        row = self.disks_in_column[column_number]
+        self.disks_in_column[column_number] += 1
+        if not animations:
+            self.scheduler.run([(pause, lambda: self.add_disk(column_number, row, color))])
+            return
 
-    def unbind_mouse(self):
-        self.unbind("<Button-1>")
+        # The disk falls from the top row, with shorter times in the lower rows.
+        time_in_each_row = [0.41421356237309515, 0.31783724519578205, 0.2679491924311228,
+                            0.2360679774997898, 0.21342176528338808]
+        total_time = 0
+        min_time = 170
+        steps = [(pause, lambda: self.add_disk(column_number, 5, color))]
+        for next_row in range(4, row - 1, -1):
+            pause_time = round(170*time_in_each_row[next_row])
+            total_time += pause_time
+            steps.append((pause_time,
+                          lambda next_row=next_row: self.move_disk(column_number,
+                                                                   next_row, color)))
+        if total_time < min_time:
+            steps.append((min_time - total_time, lambda: None))
+        self.scheduler.run(steps)
+
+    def move_disk(self, column, row, color):
+        """Move a disk from row + 1 to row."""
+        self.remove_disk(column, row + 1)
+        self.add_disk(column, row, color)
 
-    def rebind_mouse(self):
-        self.bind("<Button-1>", self.parent.mouse_click)
+    def add_disk(self, column, row, color):
+        self.itemconfig(self.disks[column][row], fill=color)
+
+    def remove_disk(self, column, row):
+        self.itemconfig(self.disks[column][row], fill=self.background_color)
+
+    def remove_all_disks(self):
+        self.disks_in_column = [0] * 7
+        for column_disks in self.disks:
+            for disk in column_disks:
+                self.itemconfig(disk, fill=self.background_color)
 
 
 class DialogBox(tk.Toplevel):
@@ -281,7 +329,7 @@ class DialogBox(tk.Toplevel):
         self.parent = parent
         self.transient(parent)
         self.title("Four in a row")
-        box_width = 300
+        box_width = 340
         box_height = 120
 
         parent_width = parent.winfo_width()
@@ -310,7 +358,9 @@ class DialogBox(tk.Toplevel):
         tk.Radiobutton(radio_button_frame, text="Medium", font=("", 10),
                        variable=parent.difficulty_level, value="Medium").pack(side=tk.LEFT)
         tk.Radiobutton(radio_button_frame, text="Hard", font=("", 10),
-                       variable=parent.difficulty_level, value="Hard").pack()
+                       variable=parent.difficulty_level, value="Hard").pack(side=tk.LEFT)
+        tk.Radiobutton(radio_button_frame, text="Expert", font=("", 10),
+                       variable=parent.difficulty_level, value="Expert").pack()
         radio_button_frame.pack()
 
         button_frame = tk.Frame(master=self, pady=10)
@@ -331,8 +381,17 @@ class DialogBox(tk.Toplevel):
     def quit(self, event=None):
         self.destroy()
 
-engine_interface = EngineInterface(2)
+parser = argparse.ArgumentParser(description="Play four in a row.")
+parser.add_argument("--stats", action="store_true",
+                    help="print statistics of the search after each engine move")
+arguments = parser.parse_args()
+
+engine_interface = EngineInterface(2, opening_book=open_book(),
+                                   position_database=open_database(),
+                                   transposition_table_file=TRANSPOSITION_TABLE_PATH,
+                                   statistics=arguments.stats)
 main_window = MainWindow()
 main_window.update()
 main_window.new_game_dialog_box()
 main_window.mainloop()
+engine_interface.close()
@@ -1,5 +1,9 @@
 
+import argparse
 from engine import EngineInterface
+from engine import TRANSPOSITION_TABLE_PATH
+from opening_book import open_book
+from position_database import open_database
 
 def print_board():
     for row in range(6):
@@ -23,6 +27,15 @@ def print_board():
 
 if __name__ == "__main__":
 
+    parser = argparse.ArgumentParser(description="Play four in a row in a terminal.")
+    parser.add_argument("--stats", action="store_true",
+                        help="print statistics of the search after each engine move")
+    parser.add_argument("--profile", nargs="?", const="profiles", default=None,
+                        metavar="DIRECTORY",
+                        help="profile the engine moves, write the profiles under DIRECTORY "
+                        "and print the functions with the most time at the end")
+    arguments = parser.parse_args()
+
     new_game = True
     computer_begin = False
 
@@ -31,10 +44,15 @@ if __name__ == "__main__":
     print()
 
     while True:
-        answer = input("Difficulty level (1-3): ")
-        if answer == "1" or answer == "2" or answer == "3":
+        answer = input("Difficulty level (1-4): ")
+        if answer == "1" or answer == "2" or answer == "3" or answer == "4":
             difficulty = int(answer)
-            engine_interface = EngineInterface(difficulty)
+            engine_interface = EngineInterface(difficulty, opening_book=open_book(),
+                                               position_database=open_database(),
+                                               transposition_table_file=TRANSPOSITION_TABLE_PATH,
+                                               statistics=arguments.stats,
+                                               profile=arguments.profile != None,
+                                               profile_directory=arguments.profile)
             print()
             break
         elif answer == "q":
@@ -60,9 +78,15 @@ if __name__ == "__main__":
         if computer_in_turn:
             # Computer makes a move
             move = engine_interface.engine_move()
+            if arguments.stats:
+                print(engine_interface.statistics_report())
+                print()
             engine_interface.make_move(move)
             if engine_interface.four_in_a_row():
                 computer_win = True
+            else:
+                # The engine searches while the player thinks.
+                engine_interface.start_pondering()
         else:
             # Player makes a move
             while True:
@@ -105,3 +129,8 @@ if __name__ == "__main__":
                 print()
             if choise == "n": break
 
+    engine_interface.close()
+    if arguments.profile != None:
+        print()
+        print(engine_interface.profile_report())
+
@@ -0,0 +1,197 @@
+"""An opening book with the best moves and scores of all positions with some numbers
+of moves, computed with the solver in engine.py.
+
+The book is a binary file with a header followed by sorted 64-bit little-endian
+words. Each word is key << 10 | (score + 64) << 3 | move, where key is the canonical
+key of a position (GameState.canonical_key), score is its value for the player in
+turn and move is a best move in the position with that key. The file is read
+through mmap with a binary search, so nothing is loaded when a book is opened.
+
+A book is made with
+
+    python opening_book.py --min-moves 10 --moves 10 --processes 4 opening_book.bin
+
+and used by giving the engine the book, for example
+EngineInterface(3, opening_book=OpeningBook("opening_book.bin")).
+
+Making a book takes a long time with the solver in Python. In samples of positions,
+a position with 12 moves took 3.7 s on average, and there are 5.8 million such
+positions, which is about 6000 CPU hours. Positions with 10 moves took up to 35 s
+each, about 12 s on average, and there are 0.8 million of them, so the command
+above takes in the order of 2500 CPU hours. A position with 6 moves took more than
+two minutes and the empty board can't be solved in a practical time, so books
+with positions with few moves are not practical.
+
+The positions are solved in parts by several processes. Solved parts are saved in
+a directory next to the book, so that an interrupted run continues where it
+stopped when it is started again.
+"""
+
+import argparse
+import array
+import mmap
+import os
+import struct
+import sys
+
+from engine import GameState, solve, move_with_score
+from parts import solve_in_parts
+
+# The header has a magic number, the version of the file format, the largest number of
+# moves made in the positions in the book and the number of positions.
+MAGIC = b"4RWB"
+VERSION = 1
+HEADER = struct.Struct("<4sIII")
+WORD = struct.Struct("<Q")
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "opening_book.bin")
+
+class OpeningBook:
+    """A read only opening book."""
+    def __init__(self, path=DEFAULT_PATH):
+        """Raise OSError if the file can't be opened and ValueError if it is not an
+        opening book of this version.
+        """
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.map) < HEADER.size:
+            self.map.close()
+            raise ValueError("Not an opening book: " + path)
+        magic, version, self.max_moves, self.size = HEADER.unpack_from(self.map)
+        if (magic != MAGIC or version != VERSION
+            or len(self.map) != HEADER.size + self.size * WORD.size):
+            self.map.close()
+            raise ValueError("Not an opening book of version %d: %s" % (VERSION, path))
+
+    def close(self):
+        self.map.close()
+
+    def get(self, game_state):
+        """Return a pair (move, score) with a best move and the score of game_state,
+        or None if the position is not in the book.
+        """
+        if game_state.number_of_moves > self.max_moves:
+            return None
+        key = game_state.key()
+        mirror_key = game_state.mirror_key()
+        canonical_key = min(key, mirror_key)
+
+        low = 0
+        high = self.size
+        while low < high:
+            middle = (low + high) // 2
+            word = WORD.unpack_from(self.map, HEADER.size + middle * WORD.size)[0]
+            if word >> 10 < canonical_key:
+                low = middle + 1
+            else:
+                high = middle
+        if low == self.size:
+            return None
+        word = WORD.unpack_from(self.map, HEADER.size + low * WORD.size)[0]
+        if word >> 10 != canonical_key:
+            return None
+
+        move = word & 7
+        if mirror_key < key:
+            move = 6 - move
+        return (move, ((word >> 3) & 127) - 64)
+
+def open_book(path=DEFAULT_PATH):
+    """Return the OpeningBook at path, or None if there is no usable book."""
+    try:
+        return OpeningBook(path)
+    except (OSError, ValueError):
+        return None
+
+def book_positions(max_moves, min_moves=0):
+    """Return a list with the moves of each position with at least min_moves and at
+    most max_moves moves that can be reached in a game, without the mirrored
+    positions. The list is sorted with the positions with the most moves first.
+    """
+    positions = []
+    keys = set()
+
+    def add_positions(game_state):
+        key = game_state.canonical_key()
+        if key in keys:
+            return
+        keys.add(key)
+        if game_state.number_of_moves >= min_moves:
+            positions.append(game_state.move_history[:game_state.number_of_moves])
+        if game_state.number_of_moves == max_moves:
+            return
+        for move in range(7):
+            if game_state.column_height[move] < 6:
+                game_state.make_move(move)
+                if not game_state.four_in_a_row():
+                    add_positions(game_state)
+                game_state.undo_last_move()
+
+    add_positions(GameState())
+    positions.sort(key=len, reverse=True)
+    return positions
+
+def write_book(path, max_moves, entries):
+    """Write a book file with entries, a list of (key, move, score) triples where key
+    is a canonical key and move a best move in the position with that key.
+    """
+    words = array.array("Q", sorted(key << 10 | (score + 64) << 3 | move
+                                    for (key, move, score) in entries))
+    if sys.byteorder == "big":
+        words.byteswap()
+
+    # The book is written to a temporary file first, so that an engine never sees
+    # a partly written book.
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, max_moves, len(words)))
+        words.tofile(f)
+    os.replace(temporary_path, path)
+
+def book_word(search, game_state):
+    """Return the word of the book entry of game_state. Called by the processes that
+    solve the positions.
+    """
+    score = solve(search, game_state)
+    move = move_with_score(search, game_state, score)
+    if game_state.mirror_key() < game_state.key():
+        move = 6 - move
+    return game_state.canonical_key() << 10 | (score + 64) << 3 | move
+
+def generate_book(path, max_moves, min_moves=0, processes=None, part_size=100,
+                  transposition_table_entries=1 << 22, verbose=False):
+    """Solve all positions with at least min_moves and at most max_moves moves and
+    write them to a book at path. The positions are solved in parts of part_size
+    positions by processes processes, by default one for each CPU. The positions
+    with the most moves are solved first, so that the transposition table of a
+    process helps when the earlier positions are solved. The solved parts are saved
+    in the directory path + ".parts" until the book is written.
+    """
+    def write(words):
+        write_book(path, max_moves, ((word >> 10, word & 7, ((word >> 3) & 127) - 64)
+                                     for word in words))
+
+    solve_in_parts(path + ".parts", book_positions(max_moves, min_moves),
+                   "%d %d" % (min_moves, max_moves), book_word, "Q", write, processes,
+                   part_size, transposition_table_entries, verbose)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Make an opening book.")
+    parser.add_argument("path", nargs="?", default=DEFAULT_PATH,
+                        help="the book file to write")
+    parser.add_argument("--moves", type=int, required=True,
+                        help="the largest number of moves in the positions in the book")
+    parser.add_argument("--min-moves", type=int, default=None,
+                        help="the smallest number of moves in the positions in the book, "
+                        "by default the same as --moves")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="the number of processes, by default the number of CPUs")
+    parser.add_argument("--part-size", type=int, default=100)
+    parser.add_argument("--transposition-table-entries", type=int, default=1 << 22)
+    arguments = parser.parse_args()
+    if arguments.min_moves == None:
+        arguments.min_moves = arguments.moves
+    generate_book(arguments.path, arguments.moves, arguments.min_moves,
+                  arguments.processes, arguments.part_size,
+                  arguments.transposition_table_entries, verbose=True)
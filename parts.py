@@ -0,0 +1,92 @@
+"""Solving many positions in parts by several processes, used to make opening books
+and position databases.
+
+The positions are split in parts, and each part is solved by a process in a pool.
+The values of a solved part are saved in a file in a parts directory, so that an
+interrupted run continues where it stopped when it is started again. The parts
+directory is removed when all positions are solved and the result is written.
+"""
+
+import array
+import multiprocessing
+import os
+import sys
+import time
+
+from engine import GameState, SearchState, TranspositionTable
+
+# The search state of a process that solves positions. It is kept between the parts,
+# so that the transposition table is reused.
+worker_search = None
+
+def solve_part(arguments):
+    """Compute the values of the positions in a part and save them in part_path."""
+    global worker_search
+    (part_path, positions, position_value, typecode,
+     transposition_table_entries) = arguments
+    if worker_search == None:
+        worker_search = SearchState(TranspositionTable(transposition_table_entries))
+    values = array.array(typecode)
+    for moves in positions:
+        game_state = GameState()
+        for move in moves:
+            game_state.make_move(move)
+        worker_search.new_search()
+        values.append(position_value(worker_search, game_state))
+    with open(part_path + ".tmp", "wb") as f:
+        values.tofile(f)
+    os.replace(part_path + ".tmp", part_path)
+    return part_path
+
+def solve_in_parts(parts_directory, positions, settings, position_value, typecode,
+                   write, processes=None, part_size=1000,
+                   transposition_table_entries=1 << 22, verbose=False):
+    """Compute position_value(search, game_state) for each position in positions,
+    which is a list with the moves of each position, and call write with an array
+    of the values, which has the given typecode. position_value must be a function
+    at the top level of a module, so that it can be sent to the processes.
+
+    The positions are solved in parts of part_size positions by processes processes,
+    by default one for each CPU, in the order of the list. The solved parts are
+    saved in parts_directory until write returns. settings is a text with the
+    settings of the run, other than the part size and the number of positions, and
+    parts from an earlier run are only used if it was made with the same settings.
+    Otherwise ValueError is raised.
+    """
+    os.makedirs(parts_directory, exist_ok=True)
+    settings = "%s %d %d\n" % (settings, part_size, len(positions))
+    settings_path = os.path.join(parts_directory, "settings")
+    if os.path.exists(settings_path):
+        with open(settings_path) as f:
+            if f.read() != settings:
+                raise ValueError("%s has parts with other settings" % parts_directory)
+    else:
+        with open(settings_path, "w") as f:
+            f.write(settings)
+
+    part_paths = [os.path.join(parts_directory, "part%06d" % i)
+                  for i in range(0, len(positions), part_size)]
+    work = [(part_path, positions[i * part_size:(i + 1) * part_size], position_value,
+             typecode, transposition_table_entries)
+            for (i, part_path) in enumerate(part_paths) if not os.path.exists(part_path)]
+    if verbose:
+        print("%d positions, %d of %d parts left"
+              % (len(positions), len(work), len(part_paths)), file=sys.stderr)
+
+    start = time.perf_counter()
+    with multiprocessing.Pool(processes) as pool:
+        for (done, part_path) in enumerate(pool.imap_unordered(solve_part, work)):
+            if verbose:
+                print("%d/%d %s %.0f s" % (done + 1, len(work), part_path,
+                                           time.perf_counter() - start), file=sys.stderr)
+
+    values = array.array(typecode)
+    for part_path in part_paths:
+        with open(part_path, "rb") as f:
+            values.frombytes(f.read())
+    write(values)
+
+    for part_path in part_paths:
+        os.remove(part_path)
+    os.remove(settings_path)
+    os.rmdir(parts_directory)
@@ -0,0 +1,205 @@
+"""A database with the scores of all positions with a fixed number of moves, computed
+with the solver in engine.py. negamax returns the score from the database when it
+reaches a position with that number of moves, instead of searching further.
+
+Only positions that can be reached in a game and where the player in turn can't make
+four in a row this move are in the database, and a position and its mirrored position
+share an entry.
+
+The database is a binary file with a header, an index and sorted 64-bit
+little-endian words. Each word is key << 8 | (score + 64), where key is the
+canonical key of a position (GameState.canonical_key) and score its value for the
+player in turn. The index has the key of the first word in each block of
+block_size words. The file is read through mmap, so nothing is loaded when a
+database is opened.
+
+A database is made with
+
+    python position_database.py --moves 8 --processes 4 position_database.bin
+
+Making a database takes a long time with the solver in Python. There are 77715
+positions with 8 moves, and in a sample they took 25 s each on average, so the
+command above takes in the order of 500 CPU hours. There are 634338 positions with
+10 moves, which took about 12 s each, in the order of 2000 CPU hours, and 4.2
+million positions with 12 moves, which took about 3.7 s each, in the order of 4000
+CPU hours. Positions with fewer moves take longer to solve, for example more than
+two minutes for a position with 6 moves.
+
+All positions are enumerated and kept in memory before they are solved, with their
+keys and the keys of all positions with fewer moves. This took 42 MB for 8 moves,
+250 MB for 10 moves and 1.7 GB and two minutes for 12 moves, in the process that
+starts the run.
+
+The positions are solved in parts by several processes. Solved parts are saved in
+a directory next to the database, so that an interrupted run continues where it
+stopped when it is started again.
+"""
+
+import argparse
+import array
+import mmap
+import os
+import struct
+import sys
+
+from engine import GameState, solve
+from parts import solve_in_parts
+
+# The header has a magic number, the version of the file format, the number of moves
+# in the positions, the number of positions and the number of words in each block.
+MAGIC = b"4RWD"
+VERSION = 1
+HEADER = struct.Struct("<4sIIII")
+WORD = struct.Struct("<Q")
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "position_database.bin")
+
+class PositionDatabase:
+    """A read only database with scores of positions."""
+    def __init__(self, path=DEFAULT_PATH):
+        """Raise OSError if the file can't be opened and ValueError if it is not a
+        position database of this version.
+        """
+        self.path = path
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.map) < HEADER.size:
+            self.map.close()
+            raise ValueError("Not a position database: " + path)
+        (magic, version, self.moves,
+         self.size, self.block_size) = HEADER.unpack_from(self.map)
+        if magic != MAGIC or version != VERSION or self.block_size == 0:
+            self.map.close()
+            raise ValueError("Not a position database of version %d: %s"
+                             % (VERSION, path))
+        self.index_size = (self.size + self.block_size - 1) // self.block_size
+        self.words_offset = HEADER.size + self.index_size * WORD.size
+        if len(self.map) != self.words_offset + self.size * WORD.size:
+            self.map.close()
+            raise ValueError("Not a position database of version %d: %s"
+                             % (VERSION, path))
+
+    def close(self):
+        self.map.close()
+
+    def get(self, game_state):
+        """Return the score of game_state for the player in turn, or None if the
+        position is not in the database.
+        """
+        key = game_state.canonical_key()
+
+        # Find the last block that starts with a key that is not larger than key.
+        low = 0
+        high = self.index_size
+        while low < high:
+            middle = (low + high) // 2
+            if WORD.unpack_from(self.map, HEADER.size + middle * WORD.size)[0] <= key:
+                low = middle + 1
+            else:
+                high = middle
+        if low == 0:
+            return None
+
+        # Search the words in the block.
+        low = (low - 1) * self.block_size
+        high = min(low + self.block_size, self.size)
+        while low < high:
+            middle = (low + high) // 2
+            word = WORD.unpack_from(self.map, self.words_offset + middle * WORD.size)[0]
+            if word >> 8 < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low == self.size:
+            return None
+        word = WORD.unpack_from(self.map, self.words_offset + low * WORD.size)[0]
+        if word >> 8 != key:
+            return None
+        return (word & 255) - 64
+
+def open_database(path=DEFAULT_PATH):
+    """Return the PositionDatabase at path, or None if there is no usable database."""
+    try:
+        return PositionDatabase(path)
+    except (OSError, ValueError):
+        return None
+
+def database_positions(moves):
+    """Return a list with a (key, moves) pair for each position in a database with
+    positions with the given number of moves, where key is the canonical key of the
+    position and moves the moves that give it. The list is sorted by key.
+    """
+    positions = {}
+    keys = set()
+
+    def add_positions(game_state):
+        key = game_state.canonical_key()
+        if key in keys:
+            return
+        keys.add(key)
+        if game_state.number_of_moves == moves:
+            if not game_state.can_win_this_move():
+                positions[key] = game_state.move_history[:moves]
+            return
+        for move in range(7):
+            if game_state.column_height[move] < 6:
+                game_state.make_move(move)
+                if not game_state.four_in_a_row():
+                    add_positions(game_state)
+                game_state.undo_last_move()
+
+    add_positions(GameState())
+    return sorted(positions.items())
+
+def write_database(path, moves, scores, block_size=256):
+    """Write a database file with scores, a list of (key, score) pairs where key
+    is a canonical key, sorted by key.
+    """
+    words = array.array("Q", (key << 8 | (score + 64) for (key, score) in scores))
+    index = array.array("Q", (words[i] >> 8 for i in range(0, len(words), block_size)))
+    if sys.byteorder == "big":
+        words.byteswap()
+        index.byteswap()
+
+    # The database is written to a temporary file first, so that an engine never
+    # sees a partly written database.
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, moves, len(words), block_size))
+        index.tofile(f)
+        words.tofile(f)
+    os.replace(temporary_path, path)
+
+def generate_database(path, moves, processes=None, part_size=1000,
+                      transposition_table_entries=1 << 22, verbose=False):
+    """Solve all positions with the given number of moves and write them to a
+    database at path. The positions are solved in parts of part_size positions by
+    processes processes, by default one for each CPU. The solved parts are saved in
+    the directory path + ".parts" until the database is written.
+    """
+    positions = database_positions(moves)
+
+    def write(scores):
+        write_database(path, moves, zip((key for (key, position_moves) in positions),
+                                        scores))
+
+    solve_in_parts(path + ".parts",
+                   [position_moves for (key, position_moves) in positions],
+                   "%d" % moves, solve, "b", write, processes, part_size,
+                   transposition_table_entries, verbose)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Make a position database.")
+    parser.add_argument("path", nargs="?", default=DEFAULT_PATH,
+                        help="the database file to write")
+    parser.add_argument("--moves", type=int, required=True,
+                        help="the number of moves in the positions in the database")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="the number of processes, by default the number of CPUs")
+    parser.add_argument("--part-size", type=int, default=1000)
+    parser.add_argument("--transposition-table-entries", type=int, default=1 << 22)
+    arguments = parser.parse_args()
+    generate_database(arguments.path, arguments.moves, arguments.processes,
+                      arguments.part_size, arguments.transposition_table_entries,
+                      verbose=True)
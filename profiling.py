@@ -0,0 +1,86 @@
+"""Profiling of engine moves with cProfile.
+
+An engine made with EngineInterface(profile=True), or in a process where the
+environment variable FOUR_IN_A_ROW_PROFILE is set, runs each engine_move in the
+profiler. The profile of each move is written to its own file in a subdirectory of
+the profile directory, named by the process id and a number for each engine in the
+process, so that several engines don't overwrite each other's profiles. The files
+can be read with pstats or tools like snakeviz, and the profiles of all moves are
+summed in a report of the functions where the most time was spent.
+
+The environment variable can be set to the directory to write the profiles to,
+for example
+
+    FOUR_IN_A_ROW_PROFILE=profiles python four_in_a_row.py
+"""
+
+import cProfile
+import io
+import itertools
+import os
+import pstats
+
+ENVIRONMENT_VARIABLE = "FOUR_IN_A_ROW_PROFILE"
+DEFAULT_DIRECTORY = "profiles"
+
+def profile_directory_from_environment():
+    """Return the profile directory given by the environment variable, or None if
+    it is not set.
+    """
+    value = os.environ.get(ENVIRONMENT_VARIABLE)
+    if not value:
+        return None
+    if value == "1":
+        return DEFAULT_DIRECTORY
+    return value
+
+# Numbers the profilers in a process.
+profiler_numbers = itertools.count(1)
+
+class MoveProfiler:
+    """Profiles function calls and keeps the sum of the profiles."""
+    def __init__(self, directory=DEFAULT_DIRECTORY):
+        """The profiles are written to a subdirectory of directory, which is
+        self.directory.
+        """
+        self.directory = os.path.join(directory, "%d-%d" % (os.getpid(),
+                                                            next(profiler_numbers)))
+        self.moves = 0
+        self.total = None
+
+    def run(self, function, *arguments):
+        """Return function(*arguments), called in the profiler. The profile is
+        written to the file moveNNNN.prof in the profile directory.
+        """
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(function, *arguments)
+        finally:
+            self.moves += 1
+            os.makedirs(self.directory, exist_ok=True)
+            profiler.dump_stats(os.path.join(self.directory,
+                                             "move%04d.prof" % self.moves))
+            if self.total == None:
+                self.total = pstats.Stats(profiler)
+            else:
+                self.total.add(profiler)
+
+    def report(self, limit=20, sort="tottime"):
+        """Return a text with the limit functions with the most time in the sum of
+        the profiles, sorted by sort, which is a sort key of pstats.Stats.sort_stats.
+        The time in a function without the functions it calls is tottime and with
+        them cumtime.
+        """
+        if self.total == None:
+            return "No profiled moves"
+        stream = io.StringIO()
+        self.total.stream = stream
+        self.total.sort_stats(sort).print_stats(limit)
+        return "Profile of %d moves in %s\n%s" % (self.moves, self.directory,
+                                                 stream.getvalue())
+
+    def save(self):
+        """Write the sum of the profiles to total.prof in the profile directory."""
+        if self.total != None:
+            os.makedirs(self.directory, exist_ok=True)
+            self.total.dump_stats(os.path.join(self.directory, "total.prof"))
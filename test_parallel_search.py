@@ -0,0 +1,48 @@
+from benchmark import load_positions
+from engine import EngineInterface
+import multiprocessing
+import sys
+import time
+
+# The middlegame and endgame positions of the benchmark, given as the columns of the
+# moves. The opening positions take too long on level 4.
+positions = [position["moves"] for position in load_positions()[1]
+             if position["phase"] in ["middlegame", "endgame"]]
+
+def search_time(difficulty_level, workers):
+    """Return the total time for a move in each position and the moves."""
+    # Level 4 is searched without a time limit, since the workers are not used
+    # with a time limit.
+    engine = EngineInterface(difficulty_level, workers=workers, seed=1,
+                             level_4_time_limit_ms=None)
+    moves = []
+    total_time = 0
+    for position in positions:
+        engine.new_game()
+        for column in position:
+            engine.make_move(int(column))
+        t0 = time.perf_counter()
+        moves.append(engine.engine_move())
+        t1 = time.perf_counter()
+        total_time += t1 - t0
+    engine.close()
+    return total_time, moves
+
+if __name__ == "__main__":
+    # Usage: python test_parallel_search.py [largest number of workers]
+    if len(sys.argv) > 1:
+        max_workers = int(sys.argv[1])
+    else:
+        max_workers = multiprocessing.cpu_count()
+    print("CPUs:", multiprocessing.cpu_count())
+    for difficulty_level in [3, 4]:
+        print("Level", difficulty_level)
+        serial_time, serial_moves = search_time(difficulty_level, 1)
+        print("1 worker: %.2f s" % serial_time)
+        workers = 2
+        while workers <= max_workers:
+            parallel_time, moves = search_time(difficulty_level, workers)
+            print("%d workers: %.2f s, speedup %.2f, same moves: %s"
+                  % (workers, parallel_time, serial_time / parallel_time,
+                     moves == serial_moves))
+            workers *= 2